@@ -0,0 +1,138 @@
+"""Local stand-in for the dashboard servers, for benchmarking captures without the network.
+
+Every dashboard's behaviour is encoded in its URL, so a synthetic catalog fully
+describes the load it puts on a run:
+
+    /dashboard/<id>?latency=200&bundle=300&assets=6&asset_latency=50&late=800&fail=error
+
+* latency        milliseconds before the HTML response starts
+* bundle         milliseconds the front-end script every dashboard shares takes to arrive;
+                 it may be cached, like the shared bundles of real dashboard front-ends
+* assets         number of images the page loads, each served after asset_latency ms
+* late           milliseconds after load before a script fetches /data/<id> and draws
+                 the "chart" (late-rendering JS, which the readiness probe has to wait for)
+* fail           "error" answers 503, "hang" holds the connection for hang seconds
+
+    python benchmarks/dashboard_server.py [--port 8765]
+"""
+import argparse
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_HANG = 60
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>Dashboard {id}</title>
+<script src="/static/app.js?latency={bundle}"></script>
+<style>body {{ font-family: sans-serif; margin: 0; }} .tiles img {{ width: 120px; height: 80px; margin: 4px; }}
+#chart {{ height: 300px; background: #eee; }} .bar {{ display: inline-block; width: 30px; margin: 2px; background: #36c; }}</style>
+</head><body>
+<h1>Dashboard {id}</h1>
+<div class="tiles">{assets}</div>
+<div id="chart">Loading...</div>
+<script>
+window.addEventListener('load', function () {{
+    setTimeout(function () {{
+        fetch('/data/{id}?latency={asset_latency}').then(function (r) {{ return r.json(); }}).then(function (data) {{
+            var chart = document.getElementById('chart');
+            chart.textContent = '';
+            data.values.forEach(function (v) {{
+                var bar = document.createElement('div');
+                bar.className = 'bar';
+                bar.style.height = v + 'px';
+                chart.appendChild(bar);
+            }});
+        }});
+    }}, {late});
+}});
+</script>
+</body></html>
+"""
+
+BUNDLE = "window.dashboardApp = {{ version: 1 }};\n/* {padding} */\n".format(padding="x" * 200000)
+
+ASSET = """<svg xmlns="http://www.w3.org/2000/svg" width="120" height="80"><rect width="120" height="80" fill="#{color}"/></svg>"""
+
+
+def number(query, name, default=0):
+    try:
+        return float(query.get(name, [default])[0])
+    except ValueError:
+        return default
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    hang_seconds = DEFAULT_HANG
+
+    def send(self, status, content_type, body, cache="no-store"):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", cache)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        segments = parts.path.strip("/").split("/")
+        kind, ident = (segments + [""])[:2]
+        time.sleep(number(query, "latency") / 1000)
+
+        if kind == "dashboard":
+            fail = query.get("fail", [""])[0]
+            if fail == "error":
+                return self.send(503, "text/plain", "Service Unavailable")
+            if fail == "hang":
+                time.sleep(self.hang_seconds)
+                return self.send(504, "text/plain", "Gateway Timeout")
+            asset_latency = int(number(query, "asset_latency"))
+            assets = "".join(f'<img src="/asset/{ident}-{i}.svg?latency={asset_latency}" alt="">'
+                             for i in range(int(number(query, "assets"))))
+            return self.send(200, "text/html; charset=utf-8", PAGE.format(
+                id=ident, assets=assets, asset_latency=asset_latency, late=int(number(query, "late")),
+                bundle=int(number(query, "bundle"))))
+        if kind == "static":
+            return self.send(200, "application/javascript", BUNDLE, cache="public, max-age=86400")
+        if kind == "asset":
+            return self.send(200, "image/svg+xml", ASSET.format(color=f"{zlib.crc32(ident.encode()) & 0xffffff:06x}"))
+        if kind == "data":
+            values = [zlib.crc32(f"{ident}-{i}".encode()) % 250 + 20 for i in range(12)]
+            return self.send(200, "application/json", json.dumps({"values": values}))
+        return self.send(404, "text/plain", "Not Found")
+
+    def log_message(self, format, *args):
+        pass # Quiet: a benchmark serves thousands of requests
+
+
+def start_server(port=0, hang_seconds=DEFAULT_HANG):
+    """Serve on 127.0.0.1:port (0 picks a free port) in a background thread; returns the server."""
+    handler = type("Handler", (DashboardHandler,), {"hang_seconds": hang_seconds})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--hang", type=float, default=DEFAULT_HANG, help=f"Seconds a fail=hang dashboard holds the connection (default: {DEFAULT_HANG}).")
+    args = parser.parse_args()
+    server = start_server(args.port, args.hang)
+    print(f"Serving synthetic dashboards on http://127.0.0.1:{server.server_address[1]}/dashboard/1 (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
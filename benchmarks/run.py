@@ -0,0 +1,215 @@
+"""End-to-end benchmark of filterthumbs.py against the local stand-in dashboard server.
+
+For each catalog size a synthetic dashboards.csv is written to a scratch
+directory, with its URLs pointing at benchmarks/dashboard_server.py. Then:
+
+1. capture run: --refresh-thumbnails, timed with --report (catalogs of up to
+   --capture-rows rows; capturing 10,000 real pages is a job for a long night)
+2. build run: --rebuild-all with --time-budget 0, i.e. writing the page from
+   whatever the store has, without opening a browser
+
+Each run records wall time, peak memory (max RSS of the filterthumbs.py
+process, not of Chrome), capture throughput and the size of the output. The
+results are written to benchmarks/results/<timestamp>.json and appended to
+benchmarks/results/history.jsonl, and each size is compared with the previous
+run of the same configuration.
+
+    python benchmarks/run.py --rows 10 100 1000 10000 --latency 200 --assets 6 --late-js 800 --failure-rate 0.05
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from dashboard_server import start_server
+from startup import REPO_DIR, SCRIPT, git_commit
+
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+HISTORY_PATH = os.path.join(RESULTS_DIR, "history.jsonl")
+
+REGIONS = {
+    "West Africa": ["Mali", "Niger", "Senegal", "Burkina Faso"],
+    "East Africa": ["Ethiopia", "Kenya", "Somalia"],
+    "Southern Africa": ["Zambia", "Malawi", "Mozambique"],
+    "Latin America": ["Guatemala", "Honduras", "Colombia"],
+}
+SEASONS = ["JAS", "OND", "MAM", "JJA"]
+TYPES = ["Design Dashboard", "Public Monitoring Dashboard", "Forecast Dashboard"]
+
+
+def write_catalog(path, rows, base_url, settings, seed):
+    """Write a synthetic catalog of rows dashboards served by base_url."""
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["CU URL", "Title", "Region", "Country", "Season", "Type", "Public", "Inactive", "Specific date?"])
+        for i in range(rows):
+            region = rng.choice(sorted(REGIONS))
+            query = {
+                "latency": max(0, int(rng.gauss(settings["latency"], settings["latency"] / 4))) if settings["latency"] else 0,
+                "bundle": settings["bundle_latency"],
+                "assets": settings["assets"],
+                "asset_latency": settings["asset_latency"],
+                "late": settings["late_js"],
+            }
+            roll = rng.random()
+            if roll < settings["failure_rate"]:
+                query["fail"] = "error"
+            elif roll < settings["failure_rate"] + settings["hang_rate"]:
+                query["fail"] = "hang"
+            url = f"{base_url}/dashboard/{i}?" + "&".join(f"{key}={value}" for key, value in query.items())
+            writer.writerow([url, f"Dashboard {i}", region, rng.choice(REGIONS[region]), rng.choice(SEASONS),
+                             rng.choice(TYPES), rng.choice(["Unlocked", "Locked"]),
+                             "Active" if rng.random() < 0.8 else "Inactive", "2024" if rng.random() < 0.1 else ""])
+
+
+def run_script(arguments, cwd):
+    """Run filterthumbs.py to completion; returns (wall seconds, peak RSS in MB, exit status)."""
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, SCRIPT] + arguments, cwd=cwd,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return time.perf_counter() - started, round(peak_mb, 1), process.returncode
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def benchmark_size(rows, options, base_url):
+    settings = vars(options)
+    scratch = tempfile.mkdtemp(prefix=f"thumbs-bench-{rows}-")
+    result = {"rows": rows}
+    try:
+        write_catalog(os.path.join(scratch, "dashboards.csv"), rows, base_url, settings, options.seed)
+        common = ["-q", "--workers", str(options.workers), "--engine", options.engine] + options.extra
+
+        if rows <= options.capture_rows:
+            # A profile of its own: every capture run starts with a cold browser cache
+            wall, peak_mb, status = run_script(common + ["--refresh-thumbnails", "--report", "capture.json",
+                                                         "--browser-profile", os.path.join(scratch, "browser-profiles")], scratch)
+            with open(os.path.join(scratch, "capture.json"), encoding="utf-8") as f:
+                report = json.load(f)
+            captured = sum(1 for entry in report["urls"].values() if entry["ok"])
+            capture_s = report["phases"].get("build: captures", {}).get("total_s", 0)
+            result["capture"] = {
+                "wall_s": round(wall, 3),
+                "capture_s": capture_s,
+                "captured": captured,
+                "failed": sum(1 for entry in report["urls"].values() if entry["ok"] is False),
+                "throughput_per_s": round(captured / capture_s, 3) if capture_s else None,
+                "peak_rss_mb": peak_mb,
+                "exit_status": status,
+                "phase_p50_s": {name.split(": ", 1)[1]: stat["p50_s"] for name, stat in report["phases"].items() if name.startswith("capture: ")},
+                "thumbnail_bytes": directory_size(os.path.join(scratch, "thumbnails", "shared")),
+            }
+
+        wall, peak_mb, status = run_script(common + ["--rebuild-all", "--time-budget", "0", "--report", "build.json"], scratch)
+        with open(os.path.join(scratch, "build.json"), encoding="utf-8") as f:
+            report = json.load(f)
+        phases = report["phases"]
+        result["build"] = {
+            "wall_s": round(wall, 3),
+            "render_s": round(sum(phases.get(f"build: {phase}", {}).get("total_s", 0) for phase in ("filter", "sprites", "render", "write")), 4),
+            "peak_rss_mb": peak_mb,
+            "exit_status": status,
+            "output_bytes": sum(os.path.getsize(os.path.join(scratch, name)) for name in os.listdir(scratch)
+                                if name.endswith((".html", ".json")) and name not in ("capture.json", "build.json")),
+        }
+    finally:
+        if options.keep:
+            print(f"  kept {scratch}")
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return result
+
+
+def previous_run(config):
+    """The latest entry in the history with the same configuration, or None."""
+    previous = None
+    try:
+        with open(HISTORY_PATH, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry.get("config") == config:
+                    previous = entry
+    except (OSError, ValueError):
+        pass
+    return previous
+
+
+def change(new, old):
+    if not old or new is None:
+        return ""
+    return f" ({(new - old) / old:+.0%})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Catalog sizes to benchmark (default: 10 100 1000 10000).")
+    parser.add_argument("--capture-rows", type=int, default=100, help="Only capture catalogs up to this many rows; larger ones are benchmarked for building only (default: 100).")
+    parser.add_argument("--latency", type=int, default=200, help="Mean milliseconds before a dashboard's HTML arrives (default: 200).")
+    parser.add_argument("--bundle-latency", type=int, default=300, help="Milliseconds the front-end script all dashboards share takes to download when it is not cached (default: 300).")
+    parser.add_argument("--assets", type=int, default=6, help="Images each dashboard loads (default: 6).")
+    parser.add_argument("--asset-latency", type=int, default=50, help="Milliseconds each image and data request takes (default: 50).")
+    parser.add_argument("--late-js", type=int, default=800, help="Milliseconds after load before a dashboard's script draws its chart (default: 800).")
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="Fraction of dashboards answering 503 (default: 0.05).")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fraction of dashboards that never answer (default: 0).")
+    parser.add_argument("--hang", type=float, default=60, help="Seconds a hanging dashboard holds the connection (default: 60).")
+    parser.add_argument("--workers", type=int, default=4, help="--workers for filterthumbs.py (default: 4).")
+    parser.add_argument("--engine", choices=["selenium", "cdp"], default="selenium")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directories.")
+    parser.add_argument("extra", nargs="*", help="Further filterthumbs.py arguments, after --, e.g. -- --faceted")
+    options = parser.parse_args()
+
+    server = start_server(hang_seconds=options.hang)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    config = {key: value for key, value in vars(options).items() if key not in ("rows", "keep")}
+    previous = previous_run(config)
+    previous_sizes = {entry["rows"]: entry for entry in previous["results"]} if previous else {}
+
+    results = []
+    for rows in options.rows:
+        print(f"{rows} rows...")
+        result = benchmark_size(rows, options, base_url)
+        results.append(result)
+        old = previous_sizes.get(rows, {})
+        capture, old_capture = result.get("capture"), old.get("capture") or {}
+        if capture:
+            print(f"  capture: {capture['captured']} captured, {capture['failed']} failed in {capture['capture_s']:.1f}s, "
+                  f"{capture['throughput_per_s']} /s{change(capture['throughput_per_s'], old_capture.get('throughput_per_s'))}, "
+                  f"peak {capture['peak_rss_mb']} MB")
+        build, old_build = result["build"], old.get("build") or {}
+        print(f"  build:   {build['wall_s']:.2f}s wall{change(build['wall_s'], old_build.get('wall_s'))}, "
+              f"{build['render_s']:.2f}s rendering{change(build['render_s'], old_build.get('render_s'))}, "
+              f"peak {build['peak_rss_mb']} MB{change(build['peak_rss_mb'], old_build.get('peak_rss_mb'))}, "
+              f"{build['output_bytes'] / 1024:.0f} KiB output")
+    server.shutdown()
+
+    entry = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(), "python": sys.version.split()[0],
+             "config": config, "results": results}
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entry, f, indent=1)
+    with open(HISTORY_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+    print(f"Results written to {os.path.relpath(path, REPO_DIR)}" + (f"; compared with the run of {previous['time']} ({previous['commit']})" if previous else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Startup benchmark for filterthumbs.py: time from launch to first output line and to exit.
+
+Runs the script in a scratch directory holding a copy of the catalog, in modes
+that never open a browser, and reports the median over several runs. It also
+checks that Selenium and webdriver_manager were not imported on the way.
+Each run's results are appended to benchmarks/results/startup.jsonl so they can
+be compared across commits.
+
+    python benchmarks/startup.py [--runs 7] [--csv dashboards.csv]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO_DIR, "filterthumbs.py")
+RESULTS_PATH = os.path.join(REPO_DIR, "benchmarks", "results", "startup.jsonl")
+
+SCENARIOS = {
+    "direct-iframes": ["--direct-iframes"],
+    "faceted": ["--faceted", "--direct-iframes"],
+    "no-op rebuild": ["--direct-iframes"], # Second run in the same directory: every page is up to date
+    "help": ["--help"],
+}
+HEAVY_MODULES = ["selenium", "webdriver_manager"]
+
+
+def time_run(arguments, cwd):
+    """(seconds to first line of output, seconds to exit) for one run of the script."""
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, SCRIPT] + arguments, cwd=cwd,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    process.stdout.readline()
+    first_output = time.perf_counter() - started
+    process.stdout.read()
+    process.wait()
+    return first_output, time.perf_counter() - started
+
+
+def imported_heavy_modules(arguments, cwd):
+    """Which of HEAVY_MODULES the script imports for these arguments."""
+    result = subprocess.run([sys.executable, "-X", "importtime", SCRIPT] + arguments, cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    names = {line.rsplit("|", 1)[-1].strip() for line in result.stderr.splitlines() if line.startswith("import time:")}
+    return sorted(module for module in HEAVY_MODULES if module in names)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=7, help="Runs per scenario (default: 7).")
+    parser.add_argument("--csv", default=os.path.join(REPO_DIR, "dashboards.csv"), help="Catalog to build from (default: the repository's dashboards.csv).")
+    args = parser.parse_args()
+
+    results = {}
+    for name, arguments in SCENARIOS.items():
+        scratch = tempfile.mkdtemp(prefix="thumbs-startup-")
+        try:
+            shutil.copy(args.csv, os.path.join(scratch, "dashboards.csv"))
+            if name == "no-op rebuild":
+                time_run(arguments, scratch)
+            timings = [time_run(arguments, scratch) for _ in range(args.runs)]
+            heavy = imported_heavy_modules(arguments, scratch)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+        results[name] = {
+            "first_output_s": round(statistics.median(t[0] for t in timings), 4),
+            "exit_s": round(statistics.median(t[1] for t in timings), 4),
+            "heavy_imports": heavy,
+        }
+        print(f"{name:16} first output {results[name]['first_output_s']:.3f}s  exit {results[name]['exit_s']:.3f}s  "
+              f"heavy imports: {', '.join(heavy) or 'none'}")
+
+    os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+    with open(RESULTS_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(),
+                            "python": sys.version.split()[0], "runs": args.runs, "results": results}) + "\n")
+    print(f"Appended to {os.path.relpath(RESULTS_PATH, REPO_DIR)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+"""Asyncio capture engine that drives several tabs of one headless Chrome over
+the Chrome DevTools Protocol (CDP).
+
+Used by filterthumbs.py when run with ``--engine cdp``. One Chrome process is
+started and ``tabs`` pages are opened in it; each tab pulls (url, thumbnail_path)
+jobs from a shared queue, so many captures can be in flight at once for far
+less memory than the same number of Selenium/chromedriver browsers.
+
+Needs the ``websockets`` package and a Chrome/Chromium binary, either on the
+PATH or named by the CHROME_BINARY environment variable.
+"""
+import asyncio
+import base64
+import contextlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+CHROME_CANDIDATES = ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome"]
+BROWSER_START_TIMEOUT = 20
+
+
+class CDPError(Exception):
+    """Raised when Chrome answers a CDP command with an error."""
+
+
+def find_chrome():
+    """Return the path of the Chrome binary to launch, or None if none is found."""
+    if os.environ.get("CHROME_BINARY"):
+        return os.environ["CHROME_BINARY"]
+    for name in CHROME_CANDIDATES:
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+class CDPConnection:
+    """One websocket to the browser, multiplexing commands and events for all tab sessions."""
+
+    def __init__(self, websocket):
+        self._ws = websocket
+        self._next_id = 0
+        self._pending = {}
+        self._listeners = []
+        self._reader = asyncio.ensure_future(self._read_loop())
+
+    async def send(self, method, params=None, session_id=None):
+        self._next_id += 1
+        message = {"id": self._next_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[self._next_id] = future
+        try:
+            await self._ws.send(json.dumps(message))
+        except Exception:
+            self._pending.pop(message["id"], None)
+            if future.done():
+                future.exception() # The read loop already failed it; mark that as seen
+            else:
+                future.cancel()
+            raise
+        return await future
+
+    def wait_for_event(self, method, session_id=None):
+        """Return a future resolved with the params of the next matching event."""
+        future = asyncio.get_running_loop().create_future()
+        self._listeners.append((session_id, method, future))
+        return future
+
+    async def _read_loop(self):
+        try:
+            async for raw in self._ws:
+                message = json.loads(raw)
+                if "id" in message:
+                    future = self._pending.pop(message["id"], None)
+                    if future is None or future.done():
+                        continue
+                    if "error" in message:
+                        future.set_exception(CDPError(message["error"].get("message", "unknown CDP error")))
+                    else:
+                        future.set_result(message.get("result", {}))
+                    continue
+                for listener in list(self._listeners):
+                    session_id, method, future = listener
+                    if future.done():
+                        self._listeners.remove(listener)
+                    elif method == message.get("method") and session_id == message.get("sessionId"):
+                        self._listeners.remove(listener)
+                        future.set_result(message.get("params", {}))
+        finally:
+            for future in list(self._pending.values()) + [l[2] for l in self._listeners]:
+                if not future.done():
+                    future.set_exception(ConnectionError("DevTools connection closed"))
+
+    async def close(self):
+        await self._ws.close()
+        self._reader.cancel()
+
+
+class CDPTab:
+    """A page target in the shared browser, attached with its own flat CDP session."""
+
+    def __init__(self, connection, target_id, session_id):
+        self.connection = connection
+        self.target_id = target_id
+        self.session_id = session_id
+
+    @classmethod
+    async def open(cls, connection, width, height, init_script=None):
+        target = await connection.send("Target.createTarget", {"url": "about:blank"})
+        attached = await connection.send("Target.attachToTarget", {"targetId": target["targetId"], "flatten": True})
+        tab = cls(connection, target["targetId"], attached["sessionId"])
+        await tab.send("Page.enable")
+        await tab.send("Emulation.setDeviceMetricsOverride", {
+            "width": width, "height": height, "deviceScaleFactor": 1, "mobile": False,
+        })
+        if init_script:
+            await tab.send("Page.addScriptToEvaluateOnNewDocument", {"source": init_script})
+        return tab
+
+    async def send(self, method, params=None):
+        return await self.connection.send(method, params, session_id=self.session_id)
+
+    async def navigate(self, url, timeout):
+        """Navigate to url and wait (at most timeout seconds) for its load event."""
+        loaded = self.connection.wait_for_event("Page.loadEventFired", self.session_id)
+        result = await self.send("Page.navigate", {"url": url})
+        if result.get("errorText"):
+            loaded.cancel()
+            raise CDPError(f"navigation failed: {result['errorText']}")
+        try:
+            await asyncio.wait_for(loaded, timeout)
+        except asyncio.TimeoutError:
+            raise CDPError(f"page did not load within {timeout}s")
+
+    async def evaluate(self, expression):
+        result = await self.send("Runtime.evaluate", {"expression": expression, "returnByValue": True, "awaitPromise": True})
+        if "exceptionDetails" in result:
+            raise CDPError(result["exceptionDetails"].get("text", "script error"))
+        return result["result"].get("value")
+
+    async def clip_rect(self, clip):
+        """Resolve a clip (a rectangle, a script locating one, or None) to an (x, y, width, height) rectangle or None."""
+        if not isinstance(clip, str):
+            return clip
+        rect = await self.evaluate(clip)
+        if not rect or not rect["width"] or not rect["height"]:
+            raise CDPError("the element to clip to is missing or empty")
+        return rect["x"], rect["y"], rect["width"], rect["height"]
+
+    async def screenshot(self, clip=None):
+        """Return a PNG screenshot of the viewport, or of the (x, y, width, height) clip, as bytes."""
+        params = {"format": "png"}
+        if clip is not None:
+            x, y, width, height = clip
+            params.update(captureBeyondViewport=True, clip={"x": x, "y": y, "width": width, "height": height, "scale": 1})
+        result = await self.send("Page.captureScreenshot", params)
+        return base64.b64decode(result["data"])
+
+    async def close(self):
+        try:
+            await self.connection.send("Target.closeTarget", {"targetId": self.target_id})
+        except (CDPError, ConnectionError):
+            pass
+
+
+class CDPBrowser:
+    """A headless Chrome process plus the DevTools connection to it."""
+
+    def __init__(self, process, connection, user_data_dir):
+        self.process = process
+        self.connection = connection
+        self.user_data_dir = user_data_dir # Throwaway profile to delete on close; None for a kept one
+
+    @classmethod
+    async def launch(cls, width, height, chrome_binary=None, profile_dir=None, cache_size=None):
+        """Start Chrome with the profile in profile_dir (kept on close), or with a throwaway one.
+
+        cache_size caps its HTTP disk cache, in bytes.
+        """
+        import websockets
+
+        chrome_binary = chrome_binary or find_chrome()
+        if not chrome_binary:
+            raise RuntimeError("No Chrome/Chromium binary found; set CHROME_BINARY.")
+        user_data_dir = os.path.abspath(profile_dir) if profile_dir else tempfile.mkdtemp(prefix="thumbs-cdp-")
+        # Chrome writes the port it picked and the browser endpoint path here; a kept
+        # profile still has the one from its last run
+        port_file = os.path.join(user_data_dir, "DevToolsActivePort")
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(port_file)
+        process = subprocess.Popen([
+            chrome_binary,
+            "--headless=new",
+            "--remote-debugging-port=0",
+            f"--user-data-dir={user_data_dir}",
+            f"--window-size={width},{height}",
+            "--hide-scrollbars",
+            "--disable-gpu",
+            "--no-sandbox",
+            "--disable-dev-shm-usage",
+        ] + ([f"--disk-cache-size={cache_size}"] if cache_size else []) + [
+            "about:blank",
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + BROWSER_START_TIMEOUT
+        while True:
+            if os.path.exists(port_file):
+                with open(port_file) as f:
+                    lines = f.read().split()
+                if len(lines) >= 2:
+                    break
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                if not profile_dir:
+                    shutil.rmtree(user_data_dir, ignore_errors=True)
+                raise RuntimeError("Chrome did not expose a DevTools endpoint")
+            await asyncio.sleep(0.1)
+
+        websocket = await websockets.connect(f"ws://127.0.0.1:{lines[0]}{lines[1]}", max_size=None)
+        return cls(process, CDPConnection(websocket), None if profile_dir else user_data_dir)
+
+    async def new_tab(self, width, height, init_script=None):
+        return await CDPTab.open(self.connection, width, height, init_script)
+
+    async def close(self):
+        try:
+            await self.connection.send("Browser.close")
+        except Exception:
+            pass # Already gone, e.g. Chrome got the same Ctrl-C
+        await self.connection.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        if self.user_data_dir:
+            shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+
+async def wait_until_ready(tab, probe_script, quiet_window, max_wait, poll_interval):
+    """Async twin of filterthumbs.wait_until_ready; returns the signal that ended the wait."""
+    expression = f"(function () {{ {probe_script} }})()"
+    deadline = time.monotonic() + max_wait
+    while time.monotonic() < deadline:
+        state = await tab.evaluate(expression)
+        if state is None:
+            await asyncio.sleep(max(0, deadline - time.monotonic()))
+            return "no probe, waited hard cap"
+        if state["loaded"] and state["inflight"] == 0 and state["quiet"] >= quiet_window:
+            return f"network idle and DOM quiet for {state['quiet']:.1f}s"
+        await asyncio.sleep(poll_interval)
+    return f"hard cap of {max_wait}s reached"
+
+
+class InOrder:
+    """The default scheduler for capture_all: jobs in the order given, no limits, retries when due."""
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, jobs):
+        self.jobs = list(jobs)
+        self.next = 0
+        self.retries = [] # [(time.monotonic() to retry at, job)]
+        self.in_flight = 0
+
+    def take(self):
+        now = time.monotonic()
+        due = [retry for retry in self.retries if retry[0] <= now]
+        if due:
+            self.retries.remove(due[0])
+            self.in_flight += 1
+            return due[0][1], None
+        if self.next < len(self.jobs):
+            self.next += 1
+            self.in_flight += 1
+            return self.jobs[self.next - 1], None
+        if self.retries:
+            return None, min(retry[0] for retry in self.retries) - now
+        return None, (self.POLL_INTERVAL if self.in_flight else None) # A job in flight may come back for a retry
+
+    def done(self, job, retry_in=None):
+        self.in_flight -= 1
+        if retry_in is not None:
+            self.retries.append((time.monotonic() + retry_in, job))
+
+    def remaining(self):
+        return len(self.jobs) - self.next + len(self.retries)
+
+
+@contextlib.contextmanager
+def span(report, phase, url):
+    """Time the enclosed block into report (a filterthumbs.RunReport), if there is one."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if report is not None:
+            report.add(phase, time.perf_counter() - started, url=url)
+
+
+async def capture_all(jobs, store_capture, tabs, width, height, init_script, probe_script,
+                      quiet_window, max_wait, page_load_timeout, poll_interval, browser=None, keep_going=None,
+                      report=None, failures=None, scheduler=None, clips=None, profile_dir=None, cache_size=None):
+    """Capture (url, thumbnail_path) jobs with `tabs` concurrent tabs of one browser.
+
+    store_capture(url, thumbnail_path, png_bytes) is called for each successful capture,
+    in a worker thread.
+    A browser that is passed in is left running; otherwise one is launched and closed.
+    keep_going() is asked before each capture; once it returns False no new capture starts.
+    Phase timings and outcomes go to report.add / report.outcome when a report is given.
+    failures (a filterthumbs.CaptureFailures) decides which URLs to skip and when to retry.
+    scheduler (a filterthumbs.HostScheduler over the same jobs) decides which job
+    each free tab takes next, retries included; without one the jobs are taken in order.
+    clips maps a url to the part of its page to capture: an (x, y, width, height)
+    rectangle or a JavaScript expression evaluating to {x, y, width, height}.
+    profile_dir and cache_size are passed to CDPBrowser.launch when no browser is given.
+    """
+    owned = browser is None
+    if owned:
+        browser = await CDPBrowser.launch(width, height, profile_dir=profile_dir, cache_size=cache_size)
+        log.info(f"Browser initialized (CDP, {tabs} tab(s)).")
+    if scheduler is None:
+        scheduler = InOrder(jobs)
+
+    async def next_job():
+        """The next job to capture, or None once there are none left."""
+        while True:
+            job, wait = scheduler.take()
+            if job is not None or wait is None:
+                return job
+            await asyncio.sleep(wait)
+
+    async def capture(tab, tab_id, url, thumbnail_path):
+        try:
+            log.debug(f"Generating thumbnail for: {url} (tab {tab_id})")
+            with span(report, "navigate", url):
+                await tab.navigate(url, page_load_timeout)
+            started = time.monotonic()
+            with span(report, "ready wait", url):
+                signal = await wait_until_ready(tab, probe_script, quiet_window, max_wait, poll_interval)
+                if failures is not None:
+                    await asyncio.sleep(failures.extra_wait(url))
+            log.debug(f"Ready after {time.monotonic() - started:.1f}s ({signal}): {url}")
+            with span(report, "screenshot", url):
+                png = await tab.screenshot(await tab.clip_rect(clips.get(url)) if clips else None)
+            # Decoding, checking, hashing and encoding the derivatives is CPU work: keep it
+            # off the event loop so the other tabs' polling and messages are not held up
+            await asyncio.get_running_loop().run_in_executor(None, store_capture, url, thumbnail_path, png)
+            if report is not None:
+                report.outcome(url, True)
+            return True
+        except Exception as e:
+            if report is not None:
+                report.outcome(url, False, e)
+            if failures is not None:
+                failures.failed(url, e) # Logs the error
+            else:
+                log.error(f"Could not generate thumbnail for {url}: {e}")
+            return False
+
+    async def tab_worker(tab_id):
+        tab = await browser.new_tab(width, height, init_script)
+        try:
+            while keep_going is None or keep_going():
+                job = await next_job()
+                if job is None:
+                    return
+                url, thumbnail_path = job
+                retry_in = None
+                try:
+                    if (failures is None or failures.allow(url)) and not await capture(tab, tab_id, url, thumbnail_path):
+                        retry_in = failures.retry_delay(url) if failures is not None else None
+                finally:
+                    scheduler.done(job, retry_in) # A retry goes back through the scheduler's limits
+        finally:
+            await tab.close()
+
+    try:
+        results = await asyncio.gather(*(tab_worker(i + 1) for i in range(tabs)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log.error(f"CDP tab failed: {result}")
+        if scheduler.remaining() and keep_going is not None and not keep_going():
+            log.info(f"Time budget reached; {scheduler.remaining()} thumbnail(s) left for the next run.")
+    finally:
+        if owned:
+            log.info("Closing browser (CDP).")
+            await browser.close()
+
+
+def capture_thumbnails(jobs, store_capture, tabs=4, **settings):
+    """Blocking entry point: run capture_all on a fresh event loop."""
+    tabs = max(1, min(tabs, len(jobs)))
+    asyncio.run(capture_all(jobs, store_capture, tabs, **settings))
+
+
+class WarmBrowser:
+    """One browser kept running between capture batches, on an event loop in a background thread.
+
+    Used by filterthumbs.py --watch so each rebuild skips starting Chrome.
+    """
+
+    def __init__(self):
+        self.browser = None
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    async def _capture(self, jobs, store_capture, tabs, **settings):
+        if self.browser is None or self.browser.process.poll() is not None:
+            self.browser = await CDPBrowser.launch(settings["width"], settings["height"],
+                                                   profile_dir=settings.get("profile_dir"), cache_size=settings.get("cache_size"))
+            log.info("Browser initialized (CDP, kept warm).")
+        await capture_all(jobs, store_capture, tabs, browser=self.browser, **settings)
+
+    def capture_thumbnails(self, jobs, store_capture, tabs=4, **settings):
+        """Blocking twin of the module-level capture_thumbnails, reusing the warm browser."""
+        tabs = max(1, min(tabs, len(jobs)))
+        asyncio.run_coroutine_threadsafe(self._capture(jobs, store_capture, tabs, **settings), self.loop).result()
+
+    def close(self):
+        if self.browser is not None:
+            log.info("Closing browser (CDP).")
+            asyncio.run_coroutine_threadsafe(self.browser.close(), self.loop).result()
+            self.browser = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -1,30 +1,1330 @@
 import pandas as pd
+import numpy as np
 import argparse
 import sys
 import re
 import os
 import hashlib
 import time
+import threading
+import glob
+import shutil
+import json
+import urllib.request
+import urllib.error
+import io
+import math
+import logging
+import contextlib
+import csv
+import base64
+import random
+from urllib.parse import urlsplit
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
+try:
+    import fcntl # Locks browser profiles against other runs; not available on Windows
+except ImportError:
+    fcntl = None
+
+try:
+    from PIL import Image, ImageOps # Optional: needed for display-sized thumbnail derivatives
+except ImportError:
+    Image = ImageOps = None
+
+# Selenium and webdriver_manager are imported only when a capture actually runs
+# (see create_driver), so runs that never open a browser start faster.
+
+log = logging.getLogger("filterthumbs")
+
+CSV_PATH = "dashboards.csv"
+CSV_CHUNKSIZE = None # Rows per chunk when reading the CSV in chunks (--chunksize); None reads it whole
+CATALOG = None # The whole CSV, read once per run when not chunking
+FACET_INDEX_PATH = CSV_PATH + ".facetindex" # Persisted FacetIndex, rebuilt whenever the CSV's hash changes
+FACET_INDEX_MAX_VALUES = 1000 # Columns with more distinct values than this are filtered by plain comparison
+FACET_INDEX = None
 
 # --- Configuration for Thumbnails ---
 THUMBNAIL_BASE_DIR = "thumbnails" # Base directory for all thumbnail subfolders
+THUMBNAIL_STORE_DIR = os.path.join(THUMBNAIL_BASE_DIR, "shared") # Content-addressed captures shared by every output page
+VALIDATOR_CACHE_PATH = os.path.join(THUMBNAIL_BASE_DIR, "validators.json") # Per-URL ETag/Last-Modified/body hash for --refresh-changed
+BUILD_MANIFEST_PATH = os.path.join(THUMBNAIL_BASE_DIR, "builds.json") # Inputs each output page was last built from
+TEMPLATE_VERSION = 2 # Bump when a change to the page-building code alters the generated HTML
+PHASH_INDEX_PATH = os.path.join(THUMBNAIL_BASE_DIR, "phashes.json") # Perceptual hash of every stored thumbnail
+PLAIN_INDEX_PATH = os.path.join(THUMBNAIL_BASE_DIR, "plain.json") # Store keys of thumbnails kept although they looked blank (plain pages)
+PHASH_SIZE = 16 # The perceptual hash has PHASH_SIZE ** 2 bits
+PHASH_THRESHOLD = 8 # A recapture differing from the stored thumbnail in fewer bits than this is not written (--change-threshold)
+CAPTURE_TIMES_PATH = os.path.join(THUMBNAIL_BASE_DIR, "captured.json") # When each stored thumbnail was captured, for --refresh-stale
+THUMBNAIL_TTL_DAYS = 7 # A thumbnail is due for recapture (--refresh-stale) after this many days...
+PINNED_DATE_TTL_DAYS = 90 # ...or this many, for dashboards showing a fixed date (the 'Specific date?' column is set)
+INACTIVE_TTL_DAYS = 365 # ...or this many, for dashboards marked inactive (the 'Inactive' column is set, but not to 'Active')
+FAILURES_PATH = os.path.join(THUMBNAIL_BASE_DIR, "failures.json") # URLs whose capture failed, skipped until their retry time
+FAILURE_TTL = 3600 # Seconds a URL that failed is skipped; doubles with every further run it fails in...
+FAILURE_TTL_MAX = 7 * 86400 # ...up to this many
+CAPTURE_RETRIES = 2 # Extra attempts at a failed capture within a run (--retries)
+RETRY_BASE_DELAY = 2.0 # Seconds before the first retry; doubles with every attempt...
+RETRY_MAX_DELAY = 30.0 # ...up to this many
+HOST_FAILURE_THRESHOLD = 3 # Failed captures in a row after which a host's remaining dashboards are skipped...
+HOST_COOLDOWN = 300 # ...for this many seconds, before one trial capture is let through
+HOST_MAX_CAPTURES = 2 # Captures of one host in flight at once (--per-host); --workers still caps the total
+HOST_MIN_INTERVAL = 0.5 # Seconds between the starts of two captures of one host (--host-interval)
+HOST_LIMITS = {} # {host: (captures in flight, seconds between starts)} for hosts needing other limits, e.g. {"iridl.ldeo.columbia.edu": (1, 2.0)}
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "filterthumbs") # Per-user state that is never published
+CHROMEDRIVER_CACHE_PATH = os.path.join(CACHE_DIR, "chromedriver.json") # chromedriver path last resolved by webdriver_manager
+CHROMEDRIVER_CACHE_TTL = 24 * 3600 # Seconds before that path is checked online again
+BROWSER_PROFILE_DIR = os.path.join(CACHE_DIR, "browser-profiles") # Chrome profiles, HTTP cache included, kept between runs (--browser-profile)
+BROWSER_CACHE_MAX_MB = 500 # Cap on each profile's HTTP disk cache; a profile grown past twice this is started afresh
+VALIDATION_TIMEOUT = 10
+WATCH_INTERVAL = 1.0 # Seconds between checks for changes in --watch mode
+VALIDATION_WORKERS = 8
+
+# --- Configuration for the Tile Grid ---
+# FRAME_MULT and FRAME_SCALE mirror --framemult and the scale(0.3) transform in
+# the page CSS: a thumbnail is drawn FRAME_WIDTH * FRAME_MULT * FRAME_SCALE CSS
+# pixels wide, and FRAME_RATIO_W2H (--wrapperframeratiow2h) times less high, so
+# that is the size its display derivatives are encoded at.
+FRAME_WIDTH = 200
+FRAME_HEIGHT = 200
+FRAME_MULT = 7
+FRAME_SCALE = 0.3
+FRAME_RATIO_W2H = 16 / 9 # The captures' THUMBNAIL_WIDTH x THUMBNAIL_HEIGHT shape, so the full-size PNG is not stretched either
+DERIVATIVE_DENSITIES = [1, 2] # srcset densities to encode
+DERIVATIVE_FORMAT = "webp" # "webp" or "jpeg"
+DERIVATIVE_QUALITY = 80
+SPRITE_DIR = os.path.join(THUMBNAIL_BASE_DIR, "sprites") # Cached atlases for --sprite pages
+SPRITE_MAX_TILES = 64 # Tiles per atlas image
+SPRITE_COLUMNS = 8
+FACET_COLUMNS = ["Region", "Country", "Season", "Type", "Public", "Group"] # Filterable columns in --faceted pages
+FACET_BATCH_SIZE = 120 # Tiles a --faceted page adds to the DOM at a time as the visitor scrolls
+MAX_LIVE_IFRAMES = 6 # Live dashboard iframes allowed to run at once in a generated page (0 = no cap)
 THUMBNAIL_WIDTH = 1280
 THUMBNAIL_HEIGHT = 720
-THUMBNAIL_CLIP_WIDTH = 200
-THUMBNAIL_CLIP_HEIGHT = 200
+THUMBNAIL_CLIP = None # Part of each dashboard page to capture (--clip); None captures the whole viewport. See parse_clip
+CLIP_COLUMN = "Clip" # Optional CSV column giving a dashboard its own clip
+THUMBNAIL_CLIP_WIDTH = 200 # A "tile" clip captures the part of the page a tile shows of a full capture: this many CSS pixels...
+THUMBNAIL_CLIP_HEIGHT = 200 # ...by this many from its top left, i.e. all of a FRAME_WIDTH x FRAME_HEIGHT tile
 PAGE_LOAD_WAIT_TIME = 20
-POST_LOAD_SLEEP_TIME = 5
+BLANK_SAMPLE_SIZE = (64, 36) # Every screenshot is checked for a blank or placeholder frame at this size...
+BLANK_MAX_SHADE = 0.97 # ...flagging it if one of 32 grey levels covers this much of it...
+BLANK_MIN_ENTROPY = 0.8 # ...or its grey-level histogram has less entropy than this many bits
+SUSPECT_RETRIES = 2 # Recaptures of a flagged frame, each waiting longer after the page settles...
+SUSPECT_EXTRA_WAIT = 5.0 # ...by this many more seconds per recapture
+READY_QUIET_WINDOW = 1.5 # Seconds with no in-flight requests and no DOM mutations before a page counts as rendered
+READY_MAX_WAIT = 15 # Hard cap in seconds on the readiness wait after <body> appears
+READY_POLL_INTERVAL = 0.25
+
+# Injected into every document before its own scripts run. Counts in-flight
+# fetch/XHR requests and records the time of the last DOM mutation so the
+# capture loop can tell when a page has settled.
+READY_INIT_SCRIPT = """
+(function () {
+    if (window.__thumbReady) return;
+    var state = window.__thumbReady = {inflight: 0, lastMutation: Date.now()};
+    if (window.fetch) {
+        var origFetch = window.fetch;
+        window.fetch = function () {
+            state.inflight++;
+            return origFetch.apply(this, arguments).finally(function () { state.inflight--; });
+        };
+    }
+    var origSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        state.inflight++;
+        this.addEventListener('loadend', function () { state.inflight--; });
+        return origSend.apply(this, arguments);
+    };
+    new MutationObserver(function () { state.lastMutation = Date.now(); })
+        .observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+})();
+"""
+
+# Polled from the capture loop; images still loading (e.g. map tiles) count as in-flight.
+# Offscreen loading="lazy" images never load in the fixed viewport, so only visible ones count.
+READY_PROBE_SCRIPT = """
+var state = window.__thumbReady;
+if (!state) return null;
+function inView(img) {
+    var r = img.getBoundingClientRect();
+    return r.bottom > 0 && r.right > 0 && r.top < window.innerHeight && r.left < window.innerWidth;
+}
+var pendingImages = Array.prototype.filter.call(document.images, function (img) {
+    return !img.complete && (img.loading !== 'lazy' || inView(img));
+}).length;
+return {
+    inflight: state.inflight + pendingImages,
+    quiet: (Date.now() - state.lastMutation) / 1000,
+    loaded: document.readyState === 'complete'
+};
+"""
+
+# --- Shared Thumbnail Store ---
+def render_params():
+    """Settings that change what a capture looks like; part of every store key."""
+    return f"{THUMBNAIL_WIDTH}x{THUMBNAIL_HEIGHT}|quiet={READY_QUIET_WINDOW}|max={READY_MAX_WAIT}"
+
+def thumbnail_key(url):
+    """Store key for url rendered with the current render_params() and clipped to clip_for(url)."""
+    clip = clip_for(url)
+    params = render_params() if clip is None else f"{render_params()}|clip={clip_key(clip)}"
+    return hashlib.md5(f"{url}|{params}".encode('utf-8')).hexdigest()
+
+def thumbnail_path_for(url):
+    return os.path.join(THUMBNAIL_STORE_DIR, f"{thumbnail_key(url)}.png")
+
+def adopt_legacy_thumbnail(url, thumbnail_path, preferred_dir=None):
+    """Hardlink a capture from an old per-page folder (thumbnails/<page>/<md5(url)>.png) into the store.
+
+    preferred_dir is searched first, then every other per-page folder, newest file first.
+    Returns True if the store now has a thumbnail for url.
+    """
+    legacy_name = f"{hashlib.md5(url.encode('utf-8')).hexdigest()}.png"
+    candidates = sorted(glob.glob(os.path.join(THUMBNAIL_BASE_DIR, "*", legacy_name)), key=os.path.getmtime, reverse=True)
+    if preferred_dir:
+        preferred = os.path.join(preferred_dir, legacy_name)
+        if preferred in candidates:
+            candidates.remove(preferred)
+            candidates.insert(0, preferred)
+    for legacy_path in candidates:
+        if os.path.dirname(legacy_path) == THUMBNAIL_STORE_DIR:
+            continue
+        try:
+            os.link(legacy_path, thumbnail_path)
+        except OSError:
+            shutil.copy2(legacy_path, thumbnail_path)
+        log.debug(f"Reusing legacy thumbnail {legacy_path} for {url}")
+        return True
+    return False
+
+# --- Clip Regions ---
+URL_CLIPS = {} # {url: clip spec} from the CSV's CLIP_COLUMN, collected by build_pages
+
+def parse_clip(spec):
+    """Parse a clip spec into what to capture of a dashboard page.
+
+    "" (or "full") is the whole viewport: None. "x,y,width,height" is that
+    rectangle in page pixels, and "tile" the rectangle behind what a tile shows
+    of a full capture: an (x, y, width, height) tuple. Anything else is a CSS
+    selector (e.g. "#map"), returned as is: the capture is the bounding box of
+    the first element it matches. Raises ValueError for a malformed or empty rectangle.
+    """
+    spec = str(spec or "").strip()
+    if spec.lower() in ("", "full"):
+        return None
+    if spec.lower() == "tile":
+        display_width, display_height = display_size()
+        return (0, 0, min(THUMBNAIL_WIDTH, round(THUMBNAIL_CLIP_WIDTH * THUMBNAIL_WIDTH / display_width)),
+                min(THUMBNAIL_HEIGHT, round(THUMBNAIL_CLIP_HEIGHT * THUMBNAIL_HEIGHT / display_height)))
+    if re.fullmatch(r"[\d\s,]+", spec):
+        rect = tuple(int(part) for part in spec.split(",") if part.strip())
+        if len(rect) != 4:
+            raise ValueError(f"clip rectangle {spec!r} needs four numbers: x,y,width,height")
+        if not rect[2] or not rect[3]:
+            raise ValueError(f"clip rectangle {spec!r} is empty")
+        return rect
+    return spec
+
+def clip_for(url):
+    """What to capture of url: its CLIP_COLUMN entry, else THUMBNAIL_CLIP, parsed. Always None without Pillow,
+    which clipped thumbnails need to be drawn."""
+    if Image is None:
+        return None
+    return parse_clip(URL_CLIPS.get(url, THUMBNAIL_CLIP))
+
+def clip_key(clip):
+    """The part of a store key naming a parsed clip."""
+    return ",".join(str(value) for value in clip) if isinstance(clip, tuple) else clip
+
+def clip_rect_script(selector):
+    """JavaScript expression for the page rectangle {x, y, width, height} of the first element matching selector, or null."""
+    return (f"(function () {{ var e = document.querySelector({json.dumps(selector)}); if (!e) return null; "
+            "var r = e.getBoundingClientRect(); "
+            "return {x: r.left + window.scrollX, y: r.top + window.scrollY, width: r.width, height: r.height}; })()")
+
+def capture_clip(url):
+    """url's clip as the capture engines take it: an (x, y, width, height) rectangle, a
+    JavaScript expression evaluating to one (element clips), or None for the whole viewport."""
+    clip = clip_for(url)
+    return clip_rect_script(clip) if isinstance(clip, str) else clip
+
+def url_clips(df):
+    """{url: clip spec} for the rows of df with a CLIP_COLUMN entry; a URL listed on several rows keeps the first."""
+    if CLIP_COLUMN not in df.columns or "CU URL" not in df.columns:
+        return {}
+    specs = df[CLIP_COLUMN].astype(str).str.strip().where(df[CLIP_COLUMN].notna(), "")
+    clips = {}
+    for url, spec in zip(df["CU URL"].astype(str)[(specs != "") & df["CU URL"].notna()], specs[specs != ""]):
+        try:
+            parse_clip(spec)
+        except ValueError as e:
+            log.warning(f"Ignoring the {CLIP_COLUMN} of {url}: {e}")
+            continue
+        clips.setdefault(url, spec)
+    return clips
+
+# --- Display Derivatives ---
+def display_size():
+    """CSS pixel size a thumbnail is drawn at in the grid."""
+    width = FRAME_WIDTH * FRAME_MULT * FRAME_SCALE
+    return round(width), round(width / FRAME_RATIO_W2H)
+
+def derivative_suffixes():
+    """[(density, suffix)] naming the derivatives of <key>.png as <key>.<suffix>."""
+    extension = "jpg" if DERIVATIVE_FORMAT == "jpeg" else DERIVATIVE_FORMAT
+    width, height = tile_size()
+    return [(density, f"{width * density}x{height * density}.{extension}") for density in DERIVATIVE_DENSITIES]
+
+def derivative_paths(thumbnail_path):
+    """[(density, path)] of the display-sized derivatives of one stored thumbnail."""
+    base = os.path.splitext(thumbnail_path)[0]
+    return [(density, f"{base}.{suffix}") for density, suffix in derivative_suffixes()]
+
+def tile_image(image, density=1, clipped=False):
+    """The part of a thumbnail (a PIL Image) its tile shows, at density times the tile's CSS size.
+
+    A capture of the whole viewport is drawn display_size() big inside a smaller
+    tile, so it is cut at the top left; a clipped capture (see clip_for) is
+    scaled to cover the tile, keeping its proportions, and centred.
+    """
+    tile_width, tile_height = tile_size()
+    size = (tile_width * density, tile_height * density)
+    image = image.convert("RGB")
+    if clipped:
+        return ImageOps.fit(image, size, Image.LANCZOS)
+    display_width, display_height = display_size()
+    box = (0, 0, image.width * tile_width / display_width, image.height * tile_height / display_height)
+    return image.resize(size, Image.LANCZOS, box=box)
+
+def write_derivatives(thumbnail_path, image, clipped=False):
+    """Encode display-sized derivatives of image (a PIL Image) next to thumbnail_path: the part its tile shows, at each density."""
+    for density, path in derivative_paths(thumbnail_path):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        tile_image(image, density, clipped).save(tmp_path, format=DERIVATIVE_FORMAT.upper(), quality=DERIVATIVE_QUALITY)
+        os.replace(tmp_path, path)
+
+def ensure_derivatives(thumbnail_path, clipped=False):
+    """Backfill derivatives for a thumbnail captured before they existed. Returns True if all are present."""
+    if Image is None:
+        return False
+    if all(os.path.exists(path) for _, path in derivative_paths(thumbnail_path)):
+        return True
+    try:
+        with Image.open(thumbnail_path) as image:
+            write_derivatives(thumbnail_path, image, clipped)
+        return True
+    except Exception as e:
+        log.warning(f"Could not build display derivatives for {thumbnail_path}: {e}")
+        return False
+
+# --- Blank Frame Detection ---
+class SuspectCapture(Exception):
+    """Raised by store_capture for a screenshot that looks blank or not yet rendered; it is not stored."""
+
+    def __init__(self, problem, phash=None):
+        super().__init__(problem)
+        self.phash = phash # Perceptual hash of the frame, to tell a page still rendering from a plain one
+
+def screenshot_problem(image):
+    """Why image (a PIL Image) looks like a blank, spinner or placeholder frame, or None if it looks rendered.
+
+    Works on a tiny grey copy: a frame that is nearly all one shade, or whose
+    histogram carries almost no information, has nothing drawn on it yet. Plain
+    pages (a few lines of text on white) look the same; CaptureFailures.settled
+    lets those through once waiting longer no longer changes them.
+    """
+    grey = np.asarray(image.convert("L").resize(BLANK_SAMPLE_SIZE, Image.BOX))
+    histogram = np.bincount(grey.ravel() // 8, minlength=32) / grey.size
+    if histogram.max() >= BLANK_MAX_SHADE:
+        return f"{histogram.max():.0%} of it is one shade"
+    shares = histogram[histogram > 0]
+    entropy = -(shares * np.log2(shares)).sum()
+    if entropy < BLANK_MIN_ENTROPY:
+        return f"grey-level entropy of only {entropy:.2f} bits"
+    return None
+
+def load_plain_keys():
+    """Read the store keys of thumbnails stored as plain pages, or return none."""
+    try:
+        with open(PLAIN_INDEX_PATH, encoding="utf-8") as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+def save_plain_keys(keys):
+    os.makedirs(THUMBNAIL_BASE_DIR, exist_ok=True)
+    tmp_path = f"{PLAIN_INDEX_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sorted(keys), f, indent=1)
+    os.replace(tmp_path, PLAIN_INDEX_PATH)
+
+def stored_looks_done(key, thumbnail_path):
+    """True if the stored thumbnail looks rendered, or was stored as a plain page. A blank frame adopted
+    from before the check existed (e.g. a spinner) is neither, so a capture looking like it is still suspect."""
+    with CAPTURED_URLS_LOCK:
+        if key in PLAIN_KEYS:
+            return True
+    try:
+        with Image.open(thumbnail_path) as image:
+            return screenshot_problem(image) is None
+    except Exception:
+        return False
+
+# --- Change Detection ---
+# A recapture that looks like the stored thumbnail leaves the file untouched, so
+# the published thumbnails (and pages built from them) only change when the
+# dashboard visibly did.
+def perceptual_hash(image):
+    """Difference hash of image (a PIL Image) as hex: one bit per pair of neighbouring pixels in a tiny grey copy."""
+    pixels = np.asarray(image.convert("L").resize((PHASH_SIZE + 1, PHASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes().hex()
+
+def hash_distance(a, b):
+    """Bits differing between two perceptual hashes; infinite if they have different sizes."""
+    if len(a) != len(b):
+        return math.inf
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def load_phashes():
+    """Read {store key: perceptual hash}, or return an empty index."""
+    try:
+        with open(PHASH_INDEX_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_phashes(phashes):
+    """Merge phashes into the index on disk."""
+    index = load_phashes()
+    index.update(phashes)
+    os.makedirs(THUMBNAIL_BASE_DIR, exist_ok=True)
+    tmp_path = f"{PHASH_INDEX_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, PHASH_INDEX_PATH)
+
+def stored_phash(key, thumbnail_path):
+    """Perceptual hash of the stored thumbnail, from the index or else from the file; None if there is none."""
+    if not os.path.exists(thumbnail_path):
+        return None
+    with CAPTURED_URLS_LOCK:
+        phash = PHASHES.get(key)
+    if phash is not None:
+        return phash
+    try:
+        with Image.open(thumbnail_path) as image:
+            return perceptual_hash(image)
+    except Exception:
+        return None
+
+# --- Sprite Atlases ---
+def tile_size():
+    """Size of the part of a thumbnail a tile actually shows (the wrapper clips the rest); derivatives and sprites are cut to it."""
+    display_width, display_height = display_size()
+    return min(FRAME_WIDTH, display_width), min(FRAME_HEIGHT, display_height)
+
+def build_sprites(thumbnail_paths, clipped=()):
+    """Pack the visible tile of each thumbnail into atlas images of up to SPRITE_MAX_TILES tiles.
+
+    clipped holds the paths of those that are clipped captures (see tile_image).
+
+    An atlas is named after its members and their file stamps, so it is only
+    rebuilt when one of its thumbnails changes. Returns (positions, atlases):
+    positions maps thumbnail_path -> (atlas index, x, y) and each atlas is
+    ({density: path}, width, height) in CSS pixels.
+    """
+    os.makedirs(SPRITE_DIR, exist_ok=True)
+    tile_width, tile_height = tile_size()
+    extension = "jpg" if DERIVATIVE_FORMAT == "jpeg" else DERIVATIVE_FORMAT
+    positions, atlases = {}, []
+    for start in range(0, len(thumbnail_paths), SPRITE_MAX_TILES):
+        members = thumbnail_paths[start:start + SPRITE_MAX_TILES]
+        columns = min(SPRITE_COLUMNS, len(members))
+        rows = math.ceil(len(members) / columns)
+        signature = [f"{tile_width}x{tile_height}", DERIVATIVE_FORMAT]
+        for path in members:
+            stat = os.stat(path)
+            signature.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+        atlas_name = hashlib.md5("|".join(signature).encode('utf-8')).hexdigest()
+        atlas_paths = {density: os.path.join(SPRITE_DIR, f"{atlas_name}@{density}x.{extension}") for density in DERIVATIVE_DENSITIES}
+
+        if all(os.path.exists(path) for path in atlas_paths.values()):
+            log.debug(f"Reusing sprite atlas {atlas_name} ({len(members)} tiles)")
+        else:
+            log.debug(f"Building sprite atlas {atlas_name} ({len(members)} tiles)")
+            for density, atlas_path in atlas_paths.items():
+                atlas = Image.new("RGB", (columns * tile_width * density, rows * tile_height * density), "white")
+                for i, path in enumerate(members):
+                    with Image.open(path) as image:
+                        tile = tile_image(image, density, path in clipped)
+                    atlas.paste(tile, ((i % columns) * tile_width * density, (i // columns) * tile_height * density))
+                tmp_path = f"{atlas_path}.tmp"
+                atlas.save(tmp_path, format=DERIVATIVE_FORMAT.upper(), quality=DERIVATIVE_QUALITY)
+                os.replace(tmp_path, atlas_path)
+
+        atlases.append((atlas_paths, columns * tile_width, rows * tile_height))
+        for i, path in enumerate(members):
+            positions[path] = (len(atlases) - 1, (i % columns) * tile_width, (i // columns) * tile_height)
+    return positions, atlases
+
+def sprite_css(atlases):
+    """One CSS rule per atlas; tiles then only need a background-position."""
+    rules = []
+    for i, (atlas_paths, width, height) in enumerate(atlases):
+        image_set = ", ".join(f'url("{path}") {density}x' for density, path in atlas_paths.items())
+        rules.append(f"""        .sprite-{i} {{
+            background-image: url("{atlas_paths[DERIVATIVE_DENSITIES[0]]}");
+            background-image: image-set({image_set});
+            background-size: {width}px {height}px;
+        }}
+""")
+    return "".join(rules)
+
+# --- Conditional Refresh ---
+def load_validators():
+    """Read the per-URL validator cache, or return an empty one."""
+    try:
+        with open(VALIDATOR_CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_validators(validators):
+    tmp_path = f"{VALIDATOR_CACHE_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(validators, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, VALIDATOR_CACHE_PATH)
+
+def check_for_change(url, cached):
+    """Validate url against its cached validators with one conditional GET.
+
+    Returns (changed, validators). A 304 answer or an identical body hash means
+    unchanged; anything else, including no cached validators, means changed.
+    """
+    request = urllib.request.Request(url, headers={"User-Agent": "filterthumbs"})
+    if cached.get("etag"):
+        request.add_header("If-None-Match", cached["etag"])
+    if cached.get("last_modified"):
+        request.add_header("If-Modified-Since", cached["last_modified"])
+    try:
+        with urllib.request.urlopen(request, timeout=VALIDATION_TIMEOUT) as response:
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "body_hash": hashlib.sha256(response.read()).hexdigest(),
+            }
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return False, cached
+        raise
+    return validators["body_hash"] != cached.get("body_hash"), validators
+
+def find_changed_urls(urls, validators):
+    """Validate urls concurrently. Returns (changed_urls, fresh_validators).
+
+    URLs that cannot be validated (network errors) are treated as unchanged so
+    an unreachable server does not cost a browser visit.
+    """
+    changed_urls, fresh_validators = [], {}
+    def check(url):
+        try:
+            return url, check_for_change(url, validators.get(url, {}))
+        except Exception as e:
+            log.warning(f"Could not validate {url}, keeping cached thumbnail: {e}")
+            return url, None
+    with ThreadPoolExecutor(max_workers=VALIDATION_WORKERS) as pool:
+        for url, result in pool.map(check, urls):
+            if result is None:
+                continue
+            changed, fresh_validators[url] = result
+            if changed:
+                changed_urls.append(url)
+    return changed_urls, fresh_validators
+
+# --- Run Report ---
+class RunReport:
+    """Timed spans of one run: per URL and phase for captures, per page and phase for the build.
+
+    Spans of the same phase add up, so a page's "render" covers all its chunks.
+    --report writes the report as JSON (percentiles per phase, slowest URLs and
+    every span) or, for a .csv path, as one row per URL or page with a column per phase.
+    """
+
+    SLOWEST = 10
+
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.urls = {} # {url: {"phases": {phase: seconds}, "ok": bool or None, "error": str}}
+        self.pages = {} # {page or "(run)": {phase: seconds}}
+
+    @contextlib.contextmanager
+    def span(self, phase, url=None, page=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - started, url=url, page=page)
+
+    def add(self, phase, seconds, url=None, page=None):
+        with self.lock:
+            if url is not None:
+                phases = self.urls.setdefault(url, {"phases": {}, "ok": None})["phases"]
+            else:
+                phases = self.pages.setdefault(page or "(run)", {})
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+    def outcome(self, url, ok, error=None):
+        with self.lock:
+            entry = self.urls.setdefault(url, {"phases": {}, "ok": None})
+            entry["ok"] = ok
+            if error is not None:
+                entry["error"] = str(error)
+
+    def phase_stats(self):
+        """{"capture: <phase>" / "build: <phase>": count, total and percentiles in seconds}."""
+        samples = {}
+        with self.lock:
+            for entry in self.urls.values():
+                for phase, seconds in entry["phases"].items():
+                    samples.setdefault(f"capture: {phase}", []).append(seconds)
+            for phases in self.pages.values():
+                for phase, seconds in phases.items():
+                    samples.setdefault(f"build: {phase}", []).append(seconds)
+        stats = {}
+        for name, values in samples.items():
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            stats[name] = {"count": len(values), "total_s": round(sum(values), 4), "p50_s": round(p50, 4),
+                           "p90_s": round(p90, 4), "p99_s": round(p99, 4), "max_s": round(max(values), 4)}
+        return stats
+
+    def slowest_urls(self):
+        with self.lock:
+            totals = [(sum(entry["phases"].values()), url, entry) for url, entry in self.urls.items()]
+        totals.sort(key=lambda item: item[0], reverse=True)
+        return [dict(url=url, total_s=round(total, 4), **entry) for total, url, entry in totals[:self.SLOWEST]]
+
+    def log_summary(self, level=logging.INFO):
+        for name, stat in sorted(self.phase_stats().items()):
+            log.log(level, f"{name:24} n={stat['count']:<5} total {stat['total_s']:8.2f}s  p50 {stat['p50_s']:.2f}s  p90 {stat['p90_s']:.2f}s  max {stat['max_s']:.2f}s")
+        for entry in self.slowest_urls()[:3]:
+            log.log(level, f"slow: {entry['total_s']:.2f}s {entry['url']}")
+
+    def write(self, path):
+        with self.lock:
+            urls = {url: dict(entry, phases=dict(entry["phases"])) for url, entry in self.urls.items()}
+            pages = {page: dict(phases) for page, phases in self.pages.items()}
+        tmp_path = f"{path}.tmp"
+        if path.endswith(".csv"):
+            phase_names = sorted({phase for entry in urls.values() for phase in entry["phases"]} |
+                                 {phase for phases in pages.values() for phase in phases})
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["kind", "name", "ok", "total_s"] + [f"{phase.replace(' ', '_')}_s" for phase in phase_names])
+                for kind, name, ok, phases in ([("capture", url, entry["ok"], entry["phases"]) for url, entry in urls.items()] +
+                                               [("build", page, None, phases) for page, phases in pages.items()]):
+                    writer.writerow([kind, name, "" if ok is None else ok, round(sum(phases.values()), 4)] +
+                                    [round(phases[phase], 4) if phase in phases else "" for phase in phase_names])
+        else:
+            report = {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "duration_s": round(time.time() - self.started, 3),
+                "phases": self.phase_stats(),
+                "slowest_urls": self.slowest_urls(),
+                "urls": urls,
+                "pages": pages,
+            }
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=1)
+        os.replace(tmp_path, path)
+
+RUN_REPORT = RunReport()
+
+# --- Staleness Scheduling ---
+def load_capture_times():
+    """Read {store key: capture time (epoch seconds)}, or return an empty record."""
+    try:
+        with open(CAPTURE_TIMES_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_capture_times(captured_at):
+    """Merge captured_at into the record on disk."""
+    capture_times = load_capture_times()
+    capture_times.update(captured_at)
+    os.makedirs(THUMBNAIL_BASE_DIR, exist_ok=True)
+    tmp_path = f"{CAPTURE_TIMES_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(capture_times, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, CAPTURE_TIMES_PATH)
+
+def row_ttls(df):
+    """Seconds the thumbnail of each row of df stays fresh, from its 'Specific date?' and 'Inactive' columns."""
+    def is_set(column):
+        if column not in df.columns:
+            return pd.Series(False, index=df.index)
+        values = df[column].astype(str).str.strip()
+        return df[column].notna() & (values != "")
+    ttl = pd.Series(THUMBNAIL_TTL_DAYS * 86400.0, index=df.index)
+    ttl = ttl.where(~is_set("Specific date?"), PINNED_DATE_TTL_DAYS * 86400.0)
+    inactive = is_set("Inactive")
+    if "Inactive" in df.columns:
+        inactive &= df["Inactive"].astype(str).str.strip().str.lower() != "active"
+    return ttl.where(~inactive, INACTIVE_TTL_DAYS * 86400.0)
+
+def url_ttls(df):
+    """{url: TTL in seconds} for the URLs of df; a URL listed on several rows gets the shortest TTL."""
+    if "CU URL" not in df.columns:
+        return {}
+    ttl = pd.Series(row_ttls(df).to_numpy(), index=df["CU URL"].astype(str))[df["CU URL"].notna().to_numpy()]
+    return ttl.groupby(level=0).min().to_dict()
+
+def staleness(url, ttl, capture_times, now):
+    """How overdue url's thumbnail is: infinite if missing, else its age in units of ttl (>= 1 means due)."""
+    thumbnail_path = thumbnail_path_for(url)
+    if not os.path.exists(thumbnail_path):
+        return math.inf
+    captured = capture_times.get(thumbnail_key(url))
+    if captured is None:
+        captured = os.path.getmtime(thumbnail_path) # Captured before times were recorded
+    return (now - captured) / ttl
+
+def within_time_budget():
+    """False once the next capture would probably not finish inside --time-budget.
+
+    The time a capture takes is estimated from the run's throughput so far.
+    """
+    if CAPTURE_DEADLINE is None:
+        return True
+    now = time.monotonic()
+    with CAPTURED_URLS_LOCK:
+        done = CAPTURE_STATS["done"]
+        started = CAPTURE_STATS["started"]
+    typical = (now - started) * max(1, args.workers) / done if done and started else 0
+    return now + typical < CAPTURE_DEADLINE
+
+# --- Capture Failures ---
+def load_capture_failures():
+    """Read {url: {"failures", "error", "failed_at", "retry_after"}}, or return an empty record."""
+    try:
+        with open(FAILURES_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def backoff(base, cap, attempt):
+    """base doubled attempt - 1 times, capped at cap, with the upper half jittered so retries spread out."""
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class CaptureFailures:
+    """What to do about dashboards that fail to capture.
+
+    * Within a run, a failed capture is retried up to CAPTURE_RETRIES times after
+      a capped, jittered exponential backoff (RETRY_BASE_DELAY, RETRY_MAX_DELAY).
+    * A host whose captures fail HOST_FAILURE_THRESHOLD times in a row is skipped
+      for HOST_COOLDOWN seconds (circuit breaker); then one trial capture is let
+      through, which closes the circuit again if it succeeds.
+    * A URL still failing at the end of a run goes into FAILURES_PATH and is left
+      out of later runs until its retry time: FAILURE_TTL after its first failed
+      run, doubling with each further one up to FAILURE_TTL_MAX.
+
+    Shared by the capture threads (or tabs), so every method takes the lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {} # {host: {"failures": failed captures in a row, "open_until": time.monotonic() or None}}
+        self.start()
+
+    def start(self):
+        """Forget the previous batch's attempts; host circuits stay as they are (--watch)."""
+        with self.lock:
+            self.attempts = {} # {url: failed attempts this batch}
+            self.errors = {} # {url: last error} of URLs that have not succeeded this batch
+            self.recovered = set() # URLs captured this batch
+            self.skipped = {} # {host: captures skipped while its circuit was open}
+            self.suspects = {} # {url: captures this batch that looked blank}
+            self.last_suspect = set() # URLs whose latest capture looked blank
+            self.suspect_phashes = {} # {url: perceptual hash of its latest blank-looking capture}
 
-# Load CSV
-df = pd.read_csv("dashboards.csv")
-print(f"DEBUG: Initial DataFrame empty: {df.empty}, length: {len(df)}") # DEBUG PRINT
+    def allow(self, url):
+        """False while url's host circuit is open."""
+        host = urlsplit(url).netloc
+        now = time.monotonic()
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None or state["open_until"] is None:
+                return True
+            if now < state["open_until"]:
+                self.skipped[host] = self.skipped.get(host, 0) + 1
+                return False
+            state["open_until"] = now + HOST_COOLDOWN # Half-open: this capture is the trial, the rest wait
+            log.info(f"Trying {host} again after {HOST_COOLDOWN}s.")
+            return True
+
+    def failed(self, url, error):
+        """Record a failed capture of url and log it: as a warning if it will be retried, else as an error.
+
+        A SuspectCapture is the page's fault, not the host's, so it does not count towards the circuit breaker.
+        """
+        host = urlsplit(url).netloc
+        if isinstance(error, SuspectCapture):
+            with self.lock:
+                self.suspects[url] = self.suspects.get(url, 0) + 1
+                self.errors[url] = f"looks unfinished: {error}"
+                self.last_suspect.add(url)
+                self.suspect_phashes[url] = error.phash
+                retry = self.suspects[url] <= SUSPECT_RETRIES
+            log.log(logging.WARNING if retry else logging.ERROR, f"Thumbnail of {url} looks unfinished ({error}); not storing it.")
+            return
+        with self.lock:
+            self.last_suspect.discard(url)
+            self.attempts[url] = self.attempts.get(url, 0) + 1
+            self.errors[url] = str(error)
+            state = self.hosts.setdefault(host, {"failures": 0, "open_until": None})
+            state["failures"] += 1
+            opened = state["failures"] >= HOST_FAILURE_THRESHOLD and state["open_until"] is None
+            if opened:
+                state["open_until"] = time.monotonic() + HOST_COOLDOWN
+            retry = self.attempts[url] <= args.retries and state["open_until"] is None
+        log.log(logging.WARNING if retry else logging.ERROR, f"Could not generate thumbnail for {url}: {error}")
+        if opened:
+            log.warning(f"{host} failed {state['failures']} captures in a row; skipping its dashboards for {HOST_COOLDOWN}s.")
+
+    def succeeded(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            self.errors.pop(url, None)
+            self.recovered.add(url)
+            self.hosts[host] = {"failures": 0, "open_until": None}
+
+    def retry_delay(self, url):
+        """Seconds to wait before retrying url, or None if it has had all its attempts or its host is skipped.
+
+        A capture that looked unfinished is retried straight away, with a longer wait (see extra_wait).
+        """
+        with self.lock:
+            suspects = self.suspects.get(url, 0) if url in self.last_suspect else None
+        if suspects is not None:
+            if suspects > SUSPECT_RETRIES:
+                return None
+            log.info(f"Recapturing {url}, waiting {self.extra_wait(url):.0f}s longer (attempt {suspects + 1} of {SUSPECT_RETRIES + 1}).")
+            return 0.0
+        with self.lock:
+            attempt = self.attempts.get(url, 0)
+            state = self.hosts.get(urlsplit(url).netloc)
+            if attempt > args.retries or (state is not None and state["open_until"] is not None):
+                return None
+        delay = backoff(RETRY_BASE_DELAY, RETRY_MAX_DELAY, attempt)
+        log.info(f"Retrying {url} in {delay:.1f}s (attempt {attempt + 1} of {args.retries + 1}).")
+        return delay
+
+    def settled(self, url, phash):
+        """True if url's captures looked blank on every recapture and this one looks like the last: it is not
+        going to render any further, so it should be stored as it is."""
+        with self.lock:
+            previous = self.suspect_phashes.get(url)
+            if self.suspects.get(url, 0) < SUSPECT_RETRIES or previous is None or phash is None:
+                return False
+        return hash_distance(phash, previous) < max(1, PHASH_THRESHOLD)
+
+    def extra_wait(self, url):
+        """Seconds to wait after the page settles, beyond the readiness wait: more for each capture that looked unfinished."""
+        with self.lock:
+            return SUSPECT_EXTRA_WAIT * self.suspects.get(url, 0)
+
+    def save(self):
+        """Record this batch's failed URLs in FAILURES_PATH and clear the ones that were captured."""
+        with self.lock:
+            errors = dict(self.errors)
+            recovered = set(self.recovered)
+            skipped = dict(self.skipped)
+        for host, count in sorted(skipped.items()):
+            log.warning(f"Skipped {count} capture(s) of {host}, which kept failing.")
+        record = load_capture_failures()
+        if not errors and not recovered & record.keys():
+            return
+        now = time.time()
+        for url in recovered:
+            record.pop(url, None)
+        for url, error in errors.items():
+            failures = record.get(url, {}).get("failures", 0) + 1
+            ttl = backoff(FAILURE_TTL, FAILURE_TTL_MAX, failures)
+            record[url] = {"failures": failures, "error": error, "failed_at": now, "retry_after": now + ttl}
+            log.debug(f"Not retrying {url} for {ttl / 3600:.1f}h.")
+        os.makedirs(THUMBNAIL_BASE_DIR, exist_ok=True)
+        tmp_path = f"{FAILURES_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, FAILURES_PATH)
+
+CAPTURE_FAILURES = CaptureFailures()
+
+# --- Capture Helpers ---
+CAPTURED_URLS = set() # URLs successfully captured during this run
+CAPTURED_URLS_LOCK = threading.Lock()
+CAPTURED_AT = {} # {store key: epoch seconds} of this run's captures, saved to CAPTURE_TIMES_PATH
+CAPTURE_DEADLINE = None # time.monotonic() by which captures should be done (--time-budget)
+CAPTURE_STATS = {"started": None, "done": 0, "changed": 0, "unchanged": 0} # For estimating how long a capture takes, and for the summary
+PHASHES = {} # {store key: perceptual hash}, loaded from PHASH_INDEX_PATH when captures start and saved after
+PLAIN_KEYS = set() # Store keys of plain pages' thumbnails, loaded from PLAIN_INDEX_PATH when captures start and saved after
+KEEP_DRIVERS = False # Set by --watch: park browsers in IDLE_DRIVERS after a build instead of quitting them
+IDLE_DRIVERS = []
+IDLE_DRIVERS_LOCK = threading.Lock()
+CHROMEDRIVER_PATH = None # Resolved by chromedriver_path(); "" when only Selenium Manager is left
+CHROMEDRIVER_LOCK = threading.Lock()
+WARM_CDP_BROWSER = None # cdp_capture.WarmBrowser kept between builds with --watch --engine cdp
+BROWSER_PROFILES = {} # {driver or WarmBrowser: profile directory it was started with}
+PROFILE_LOCKS = {} # {profile directory: open lock file} of the profiles this run is using
+PROFILE_LOCKS_LOCK = threading.Lock()
+
+def chromedriver_path():
+    """Path of the chromedriver to start browsers with, resolved at most once per run.
+
+    A path cached in CHROMEDRIVER_CACHE_PATH is used while it is less than
+    CHROMEDRIVER_CACHE_TTL old; otherwise webdriver_manager resolves (and if need
+    be downloads) a matching driver. When that fails, e.g. offline, the cached
+    path or a chromedriver on the PATH is used, and failing those None lets
+    Selenium find a driver itself.
+    """
+    global CHROMEDRIVER_PATH
+    with CHROMEDRIVER_LOCK:
+        if CHROMEDRIVER_PATH is not None:
+            return CHROMEDRIVER_PATH or None
+        try:
+            with open(CHROMEDRIVER_CACHE_PATH, encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+        cached_path = cached.get("path") if cached.get("path") and os.path.exists(cached["path"]) else None
+        if cached_path and time.time() - cached.get("resolved_at", 0) < CHROMEDRIVER_CACHE_TTL:
+            CHROMEDRIVER_PATH = cached_path
+            return CHROMEDRIVER_PATH
+        try:
+            from webdriver_manager.chrome import ChromeDriverManager
+            CHROMEDRIVER_PATH = ChromeDriverManager().install()
+            os.makedirs(os.path.dirname(CHROMEDRIVER_CACHE_PATH), exist_ok=True)
+            tmp_path = f"{CHROMEDRIVER_CACHE_PATH}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"path": CHROMEDRIVER_PATH, "resolved_at": time.time()}, f)
+            os.replace(tmp_path, CHROMEDRIVER_CACHE_PATH)
+        except Exception as e:
+            CHROMEDRIVER_PATH = cached_path or shutil.which("chromedriver") or ""
+            log.warning(f"Could not resolve chromedriver with webdriver_manager ({e}); using {CHROMEDRIVER_PATH or 'Selenium Manager'}.")
+        return CHROMEDRIVER_PATH or None
+
+# --- Browser Profiles ---
+def directory_megabytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(OSError):
+                total += os.path.getsize(os.path.join(root, name))
+    return total / 2 ** 20
+
+def lock_profile(path):
+    """Lock the profile directory path for this run; False if another browser (of this run or another) has it."""
+    os.makedirs(path, exist_ok=True)
+    with PROFILE_LOCKS_LOCK:
+        if path in PROFILE_LOCKS:
+            return False
+        lock_file = open(os.path.join(path, ".lock"), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        PROFILE_LOCKS[path] = lock_file
+        return True
+
+def release_profile(path):
+    with PROFILE_LOCKS_LOCK:
+        lock_file = PROFILE_LOCKS.pop(path, None)
+    if lock_file is not None:
+        lock_file.close()
+
+def empty_profile(path):
+    """Delete everything in the (locked) profile directory path but its lock file."""
+    for name in os.listdir(path):
+        if name != ".lock":
+            entry = os.path.join(path, name)
+            if os.path.isdir(entry) and not os.path.islink(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                with contextlib.suppress(OSError):
+                    os.remove(entry)
+
+def claim_profile():
+    """A profile directory for one browser to keep its cache in between runs, or None for a throwaway profile.
+
+    Chrome cannot share a profile between processes, so every browser gets its own
+    numbered slot under BROWSER_PROFILE_DIR, locked for as long as the browser runs.
+    The same slots come back run after run, so shared scripts, styles and map
+    tiles are already cached. A slot grown past twice BROWSER_CACHE_MAX_MB (caches
+    the size cap does not cover, e.g. compiled code) is emptied first.
+    """
+    if not BROWSER_PROFILE_DIR:
+        return None
+    slot = 0
+    while True:
+        path = os.path.join(BROWSER_PROFILE_DIR, str(slot))
+        try:
+            if lock_profile(path):
+                break
+        except OSError as e:
+            log.warning(f"Could not use browser profile {path} ({e}); starting with an empty one.")
+            return None
+        slot += 1
+    size = directory_megabytes(path)
+    if size > 2 * BROWSER_CACHE_MAX_MB:
+        log.info(f"Browser profile {path} has grown to {size:.0f} MB; starting it afresh.")
+        empty_profile(path)
+    return path
+
+def clear_profiles():
+    """Empty every browser profile under BROWSER_PROFILE_DIR not in use by another run (--clear-browser-cache)."""
+    if not BROWSER_PROFILE_DIR or not os.path.isdir(BROWSER_PROFILE_DIR):
+        return
+    cleared = 0
+    for name in sorted(os.listdir(BROWSER_PROFILE_DIR)):
+        path = os.path.join(BROWSER_PROFILE_DIR, name)
+        if os.path.isdir(path) and lock_profile(path):
+            cleared += directory_megabytes(path)
+            empty_profile(path)
+            release_profile(path)
+        elif os.path.isdir(path):
+            log.warning(f"Not clearing browser profile {path}: another run is using it.")
+    log.info(f"Cleared {cleared:.0f} MB of browser profiles in {BROWSER_PROFILE_DIR}.")
+
+def create_driver():
+    """Start one headless Chrome sized to the thumbnail viewport, with a profile from claim_profile()."""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service as ChromeService
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    options.add_argument(f"--window-size={THUMBNAIL_WIDTH},{THUMBNAIL_HEIGHT}")
+    options.add_argument("--hide-scrollbars")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    profile = claim_profile()
+    if profile:
+        options.add_argument(f"--user-data-dir={os.path.abspath(profile)}")
+        options.add_argument(f"--disk-cache-size={BROWSER_CACHE_MAX_MB * 2 ** 20}")
+    try:
+        driver = webdriver.Chrome(service=ChromeService(chromedriver_path()), options=options)
+    except Exception:
+        release_profile(profile)
+        raise
+    BROWSER_PROFILES[driver] = profile
+    driver.set_page_load_timeout(PAGE_LOAD_WAIT_TIME) # A hanging host fails the capture instead of blocking driver.get for minutes
+    try:
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": READY_INIT_SCRIPT})
+    except Exception as e:
+        log.warning(f"Could not install readiness probe, captures will wait the full {READY_MAX_WAIT}s: {e}")
+    return driver
+
+def wait_until_ready(driver):
+    """Wait until the loaded page has settled and return the signal that ended the wait.
+
+    A page is ready once the document has loaded, nothing is in flight and the
+    DOM has been quiet for READY_QUIET_WINDOW seconds. READY_MAX_WAIT caps the wait.
+    """
+    deadline = time.monotonic() + READY_MAX_WAIT
+    while time.monotonic() < deadline:
+        try:
+            state = driver.execute_script(READY_PROBE_SCRIPT)
+        except Exception:
+            state = None
+        if state is None:
+            # No probe in this document (non-Chrome driver or CDP unavailable): sit out the cap
+            time.sleep(max(0, deadline - time.monotonic()))
+            return "no probe, waited hard cap"
+        if state["loaded"] and state["inflight"] == 0 and state["quiet"] >= READY_QUIET_WINDOW:
+            return f"network idle and DOM quiet for {state['quiet']:.1f}s"
+        time.sleep(READY_POLL_INTERVAL)
+    return f"hard cap of {READY_MAX_WAIT}s reached"
+
+def store_capture(url, thumbnail_path, png):
+    """Write one captured screenshot (PNG bytes) to its thumbnail path.
+
+    The file is replaced atomically so pages sharing it never see a partial image
+    and any hardlinked legacy copy keeps its old contents. If the screenshot's
+    perceptual hash is within PHASH_THRESHOLD bits of the stored thumbnail's,
+    the stored thumbnail is kept as it is. A screenshot that looks blank or
+    unfinished raises SuspectCapture and is not stored, unless it looks the same
+    as a stored thumbnail that is not blank itself (see stored_looks_done), or it
+    is the last recapture and looks the same as the one before (either way the
+    page is just plain; its key goes into PLAIN_KEYS).
+    """
+    key = os.path.splitext(os.path.basename(thumbnail_path))[0]
+    image = phash = old_phash = problem = None
+    if Image is not None:
+        try:
+            image = Image.open(io.BytesIO(png))
+            with RUN_REPORT.span("check", url=url):
+                problem = screenshot_problem(image)
+                phash = perceptual_hash(image)
+        except Exception as e:
+            log.warning(f"Could not check the capture of {url}: {e}")
+        try:
+            with RUN_REPORT.span("compare", url=url):
+                old_phash = stored_phash(key, thumbnail_path)
+        except Exception as e:
+            log.warning(f"Could not compare the capture of {url} with its stored thumbnail: {e}")
+        # A plain page (an error page, sparse text) looks the same as its stored thumbnail: no need to wait for more,
+        # unless that thumbnail is a blank frame itself
+        if problem and not (phash is not None and old_phash is not None and hash_distance(phash, old_phash) < max(PHASH_THRESHOLD, 1)
+                            and stored_looks_done(key, thumbnail_path)):
+            if not CAPTURE_FAILURES.settled(url, phash):
+                raise SuspectCapture(problem, phash)
+            log.info(f"{url} still looks the same after waiting longer ({problem}); storing it as it is.")
+    changed = phash is None or old_phash is None or hash_distance(phash, old_phash) >= PHASH_THRESHOLD
+    if changed:
+        tmp_path = f"{thumbnail_path}.{threading.get_ident()}.tmp"
+        with RUN_REPORT.span("write", url=url):
+            with open(tmp_path, "wb") as f:
+                f.write(png)
+            os.replace(tmp_path, thumbnail_path)
+        if image is not None:
+            # Derivatives come straight from the in-memory screenshot
+            try:
+                with RUN_REPORT.span("derivatives", url=url):
+                    write_derivatives(thumbnail_path, image, clip_for(url) is not None)
+            except Exception as e:
+                log.warning(f"Could not build display derivatives for {url}: {e}")
+    with CAPTURED_URLS_LOCK:
+        CAPTURED_URLS.add(url)
+        CAPTURED_AT[key] = time.time()
+        CAPTURE_STATS["done"] += 1
+        CAPTURE_STATS["changed" if changed else "unchanged"] += 1
+        if phash is not None:
+            PHASHES[key] = phash if changed else old_phash # The stored file's hash, which may have come from the file itself
+        if problem:
+            PLAIN_KEYS.add(key)
+        elif changed:
+            PLAIN_KEYS.discard(key)
+    CAPTURE_FAILURES.succeeded(url)
+    if changed:
+        log.debug(f"Thumbnail saved: {thumbnail_path}")
+    else:
+        log.debug(f"Looks unchanged ({hash_distance(phash, old_phash)} bit(s) differ), keeping {thumbnail_path}")
+
+def take_screenshot(driver, clip=None):
+    """PNG bytes of the viewport, or only of clip (a rectangle or a script locating one; see capture_clip)."""
+    if clip is None:
+        return driver.get_screenshot_as_png()
+    if isinstance(clip, str):
+        rect = driver.execute_script(f"return {clip}")
+        if not rect or not rect["width"] or not rect["height"]:
+            raise RuntimeError("the element to clip to is missing or empty")
+        clip = (rect["x"], rect["y"], rect["width"], rect["height"])
+    x, y, width, height = clip
+    result = driver.execute_cdp_cmd("Page.captureScreenshot", {
+        "format": "png", "captureBeyondViewport": True,
+        "clip": {"x": x, "y": y, "width": width, "height": height, "scale": 1},
+    })
+    return base64.b64decode(result["data"])
+
+def capture_thumbnail(driver, url, thumbnail_path):
+    """Load url in driver and save a screenshot to thumbnail_path. Returns True on success."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    try:
+        log.debug(f"Generating thumbnail for: {url}")
+        with RUN_REPORT.span("navigate", url=url):
+            driver.get(url)
+        if driver.execute_script("return location.href").startswith("chrome-error:"):
+            # Chrome shows its own error page instead of raising (unreachable host, DNS failure...)
+            raise RuntimeError("page could not be loaded")
+        with RUN_REPORT.span("body wait", url=url):
+            WebDriverWait(driver, PAGE_LOAD_WAIT_TIME).until(
+                EC.presence_of_element_located((By.TAG_NAME, "body"))
+            )
+        started = time.monotonic()
+        with RUN_REPORT.span("ready wait", url=url):
+            signal = wait_until_ready(driver)
+            time.sleep(CAPTURE_FAILURES.extra_wait(url))
+        log.debug(f"Ready after {time.monotonic() - started:.1f}s ({signal}): {url}")
+
+        with RUN_REPORT.span("screenshot", url=url):
+            png = take_screenshot(driver, capture_clip(url))
+        store_capture(url, thumbnail_path, png)
+        RUN_REPORT.outcome(url, True)
+        return True
+    except Exception as e:
+        RUN_REPORT.outcome(url, False, e)
+        CAPTURE_FAILURES.failed(url, e)
+        return False
+
+def checkout_driver():
+    """A warm browser parked by an earlier build if one is still alive, otherwise a new one."""
+    while True:
+        with IDLE_DRIVERS_LOCK:
+            if not IDLE_DRIVERS:
+                break
+            driver = IDLE_DRIVERS.pop()
+        try:
+            driver.current_url # Raises if the browser died while parked
+            return driver
+        except Exception:
+            quit_driver(driver)
+    return create_driver()
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    release_profile(BROWSER_PROFILES.pop(driver, None))
+
+def release_driver(driver, worker_id):
+    """Park driver for the next build (--watch) or shut it down."""
+    if KEEP_DRIVERS:
+        with IDLE_DRIVERS_LOCK:
+            IDLE_DRIVERS.append(driver)
+        log.info(f"Keeping browser warm (worker {worker_id}).")
+    else:
+        log.info(f"Closing browser (worker {worker_id}).")
+        quit_driver(driver)
+
+def close_idle_drivers():
+    global WARM_CDP_BROWSER
+    if WARM_CDP_BROWSER is not None:
+        WARM_CDP_BROWSER.close()
+        release_profile(BROWSER_PROFILES.pop(WARM_CDP_BROWSER, None))
+        WARM_CDP_BROWSER = None
+    with IDLE_DRIVERS_LOCK:
+        drivers = IDLE_DRIVERS[:]
+        IDLE_DRIVERS.clear()
+    for driver in drivers:
+        quit_driver(driver)
+
+class HostScheduler:
+    """Hands out (url, thumbnail_path) jobs so the capture workers spread over hosts politely.
+
+    A host has at most HOST_MAX_CAPTURES captures in flight, started at least
+    HOST_MIN_INTERVAL seconds apart (HOST_LIMITS overrides both per host). Of the
+    hosts that may start a capture, the one with the fewest in flight goes next,
+    so while one server is saturated the workers keep the others busy; ties go
+    to the job queued first, keeping the planned order (most stale first).
+    A failed job handed back for a retry (see done) waits out its backoff and
+    then goes through the same limits, ahead of its host's other jobs.
+    """
+
+    POLL_INTERVAL = 0.1 # Seconds a worker waits before asking again when every host is at its limit
+
+    def __init__(self, jobs, per_host=HOST_MAX_CAPTURES, interval=HOST_MIN_INTERVAL):
+        self.lock = threading.Lock()
+        self.queues = {} # {host: deque of (position in jobs, job)}
+        self.positions = {}
+        for position, job in enumerate(jobs):
+            self.queues.setdefault(urlsplit(job[0]).netloc, deque()).append((position, job))
+            self.positions.setdefault(job, position)
+        self.retries = {host: [] for host in self.queues} # {host: [(time.monotonic() to retry at, position, job)]}
+        self.limits = {host: HOST_LIMITS.get(host, (per_host, interval)) for host in self.queues}
+        self.in_flight = dict.fromkeys(self.queues, 0)
+        self.next_start = dict.fromkeys(self.queues, 0.0) # time.monotonic() before which the host gets no new capture
+
+    def take(self):
+        """(job, None) for a job that may start now, (None, seconds to wait) if every host
+        with jobs left is at its limit, or (None, None) once no jobs are left, in flight
+        (they may come back for a retry) or waiting to be retried."""
+        now = time.monotonic()
+        with self.lock:
+            ready, wait = [], math.inf
+            for host, jobs in self.queues.items():
+                retries = self.retries[host]
+                if not jobs and not retries:
+                    if self.in_flight[host]:
+                        wait = min(wait, self.POLL_INTERVAL)
+                    continue
+                due = [retry for retry in retries if retry[0] <= now]
+                if self.in_flight[host] >= max(1, self.limits[host][0]):
+                    wait = min(wait, self.POLL_INTERVAL)
+                elif self.next_start[host] > now:
+                    wait = min(wait, self.next_start[host] - now)
+                elif due or jobs:
+                    ready.append((self.in_flight[host], min(due)[1] if due else jobs[0][0], host))
+                else:
+                    wait = min(wait, min(retries)[0] - now)
+            if not ready:
+                return None, None if wait == math.inf else wait
+            host = min(ready)[2]
+            self.in_flight[host] += 1
+            self.next_start[host] = now + self.limits[host][1]
+            due = [retry for retry in self.retries[host] if retry[0] <= now]
+            if due:
+                self.retries[host].remove(min(due))
+                return min(due)[2], None
+            return self.queues[host].popleft()[1], None
+
+    def done(self, job, retry_in=None):
+        """Release a job taken with take(); with retry_in (seconds), queue it again to be retried no sooner."""
+        host = urlsplit(job[0]).netloc
+        with self.lock:
+            self.in_flight[host] -= 1
+            if retry_in is not None:
+                self.retries[host].append((time.monotonic() + retry_in, self.positions[job], job))
+
+    def remaining(self):
+        with self.lock:
+            return sum(len(jobs) + len(self.retries[host]) for host, jobs in self.queues.items())
+
+def capture_worker(worker_id, scheduler):
+    """Capture the jobs scheduler hands out with a private browser instance.
+
+    Failed captures are handed back to the scheduler for a retry as
+    CAPTURE_FAILURES allows, and jobs of hosts it is skipping are dropped.
+    """
+    try:
+        driver = checkout_driver()
+        log.info(f"Browser initialized (worker {worker_id}).")
+    except Exception as e:
+        log.error(f"Could not initialize browser (worker {worker_id}): {e}")
+        return
+    try:
+        while within_time_budget():
+            job, wait = scheduler.take()
+            if job is None:
+                if wait is None:
+                    break
+                time.sleep(wait)
+                continue
+            url, thumbnail_path = job
+            retry_in = None
+            try:
+                if CAPTURE_FAILURES.allow(url) and not capture_thumbnail(driver, url, thumbnail_path):
+                    retry_in = CAPTURE_FAILURES.retry_delay(url)
+            finally:
+                scheduler.done(job, retry_in) # A retry goes back through the host's limits
+    finally:
+        release_driver(driver, worker_id)
+
+def capture_thumbnails(jobs, workers=1):
+    """Capture all (url, thumbnail_path) jobs using a bounded pool of browsers.
+
+    Blocks until every worker has finished, so callers can assemble HTML
+    straight afterwards. Jobs a worker could not handle (e.g. the browser
+    failed to start) are simply left without a thumbnail.
+    """
+    scheduler = HostScheduler(jobs, args.per_host, args.host_interval)
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        capture_worker(1, scheduler)
+    else:
+        threads = [threading.Thread(target=capture_worker, args=(i + 1, scheduler), daemon=True) for i in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    if scheduler.remaining() and not within_time_budget():
+        log.info(f"Time budget reached; {scheduler.remaining()} thumbnail(s) left for the next run.")
 
 # Define columns to EXCLUDE from the dynamic thumbnail title
 EXCLUDE_FROM_TITLE_COLUMNS = [
@@ -36,126 +1336,13 @@ EXCLUDE_FROM_TITLE_COLUMNS = [
     "Specific date?",
     "Behind VPN?",
     "User",
-    "Password"
+    "Password",
+    CLIP_COLUMN
 ]
 
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description="Generate HTML dashboards based on filtered CSV data with cached, refreshed, or direct iframe content.")
-parser.add_argument("--filter", nargs='*', help="Filter conditions as key-value pairs (e.g., --filter Country Mali Season JAS Type 'Design Dashboard'). For multiple values for a single column, use a comma-separated list (e.g., --filter Season JAS,OND).")
-parser.add_argument("--output", help="Specify the output HTML filename (e.g., --output my_dashboards.html). If not specified, a filename will be generated based on filter criteria.")
-parser.add_argument("--refresh-thumbnails", action="store_true", help="Force regeneration of all thumbnails, ignoring cached versions.")
-# New command-line option for direct iframes
-parser.add_argument("--direct-iframes", action="store_true", help="Generate HTML using iframes directly for all dashboards, skipping thumbnail generation/caching.")
-args = parser.parse_args()
-
-# Apply filters
-filter_summary = []
-if args.filter:
-    filter_dict = {}
-    it = iter(args.filter)
-    for x in it:
-        try:
-            key = x
-            value = next(it)
-            if ',' in value:
-                filter_dict[key] = value.split(',')
-                filter_summary.append(f"{key}_{'_'.join(value.split(','))}")
-            else:
-                filter_dict[key] = [value]
-                filter_summary.append(f"{key}_{value}")
-        except StopIteration:
-            print(f"Warning: Missing value for filter key '{x}'. Skipping.")
-            break
-
-    for column, values in filter_dict.items():
-        if column in df.columns:
-            # Ensure column is string type for case-insensitive comparison
-            df[column] = df[column].astype(str)
-            df = df[df[column].str.lower().isin([v.lower() for v in values])]
-        else:
-            print(f"Warning: Column '{column}' not found in the CSV. Skipping this filter.")
-    print(f"DEBUG: DataFrame empty after filters: {df.empty}, length: {len(df)}") # DEBUG PRINT
-    if not df.empty:
-        print(f"DEBUG: First 5 rows after filters:\n{df.head().to_string()}") # DEBUG PRINT
-    else:
-        print("DEBUG: No rows left after applying filters.")
-
-# Determine the output filename
-output_filename = args.output
-if not output_filename:
-    if filter_summary:
-        base_name = "_".join(filter_summary)
-        base_name = re.sub(r'[^\w-]', '', base_name)
-        base_name = re.sub(r'__+', '_', base_name)
-        base_name = base_name.strip('_')
-        output_filename = f"{base_name}_dashboards.html".lower()
-    else:
-        output_filename = "all_dashboards.html"
-
-# --- Add 'cached' to filename if cached option is used and not direct iframes ---
-# 'cached' suffix implies that thumbnails are being used AND they are not forced to refresh
-if not args.refresh_thumbnails and not args.direct_iframes:
-    name, ext = os.path.splitext(output_filename)
-    output_filename = f"{name}_cached{ext}"
-    print(f"Using cached thumbnails. Output filename will be: {output_filename}")
-elif args.direct_iframes:
-    # If direct iframes are used, no cached suffix is relevant
-    print("Generating HTML with direct iframe embeds (no thumbnails).")
-else: # args.refresh_thumbnails is True
-    print("Generating HTML with refreshed thumbnails.")
-
-# --- Define unique thumbnail directory for this run ---
-# Example: "all_dashboards_cached.html" -> "thumbnails/all_dashboards_cached/"
-thumbnail_subdir_name = os.path.splitext(output_filename)[0]
-CURRENT_THUMBNAIL_DIR = os.path.join(THUMBNAIL_BASE_DIR, thumbnail_subdir_name)
-print(f"DEBUG: Thumbnails will be stored in: {os.path.abspath(CURRENT_THUMBNAIL_DIR)}") # DEBUG PRINT
-
-# --- Thumbnail Generation Logic ---
-# Ensure unique thumbnail subdirectory exists only if we are using thumbnails
-if not args.direct_iframes:
-    if not os.path.exists(CURRENT_THUMBNAIL_DIR):
-        os.makedirs(CURRENT_THUMBNAIL_DIR)
-        print(f"DEBUG: Created thumbnail directory: {CURRENT_THUMBNAIL_DIR}") # DEBUG PRINT
-    else:
-        print(f"DEBUG: Thumbnail directory already exists: {CURRENT_THUMBNAIL_DIR}") # DEBUG PRINT
-
-# Setup Selenium WebDriver in headless mode if needed for thumbnail generation
-# Driver is only initialized if we are NOT in direct-iframes mode AND
-# either a refresh is forced OR some thumbnails are missing
-driver = None
-if not args.direct_iframes and df["CU URL"].any():
-    should_initialize_driver = args.refresh_thumbnails
-    if not should_initialize_driver: # If not forced refresh, check if any thumbnail is missing
-        for _, row in df.iterrows():
-            url = row["CU URL"] if "CU URL" in df.columns and pd.notna(row["CU URL"]) else None
-            if url and url != "#":
-                url_hash = hashlib.md5(str(url).encode('utf-8')).hexdigest()
-                # Use CURRENT_THUMBNAIL_DIR for checking existence
-                thumbnail_path = os.path.join(CURRENT_THUMBNAIL_DIR, f"{url_hash}.png")
-                if not os.path.exists(thumbnail_path):
-                    should_initialize_driver = True
-                    break # Found a missing thumbnail, so driver is needed
-
-    if should_initialize_driver:
-        print("Initializing headless browser for thumbnail generation...")
-        options = webdriver.ChromeOptions()
-        options.add_argument("--headless")
-        options.add_argument(f"--window-size={THUMBNAIL_WIDTH},{THUMBNAIL_HEIGHT}")
-        options.add_argument("--hide-scrollbars")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-
-        try:
-            driver = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
-            print("Browser initialized.")
-        except Exception as e:
-            print(f"Error initializing browser: {e}")
-            print("Thumbnails will NOT be generated. HTML will use iframes directly if CU URL exists.")
-            driver = None # Set driver to None if initialization fails
-
-# Start HTML
-html = """<!DOCTYPE HTML>
+# --- Page Template ---
+# FRAME_WIDTHpx, FRAME_RATIO_W2H and EXTRA_RULES are filled in per page by page_head()
+PAGE_HEAD = """<!DOCTYPE HTML>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -163,9 +1350,9 @@ html = """<!DOCTYPE HTML>
     <title>Dashboard Links</title>
     <style>
         :root {
-            --framewidth: 200px;
+            --framewidth: FRAME_WIDTHpx;
             --frameheight: 200px;
-            --wrapperframeratiow2h: 2.00;
+            --wrapperframeratiow2h: FRAME_RATIO_W2H;
             --framemult: 7;
         }
 
@@ -196,6 +1383,16 @@ html = """<!DOCTYPE HTML>
             /* object-fit: cover; -- You can uncomment this if you prefer the image to cover the scaled area,
                                   -- but it might crop if aspect ratios differ significantly after scaling. */
         }
+        /* Tiles drawn from a sprite atlas; .sprite-N rules below pick the atlas */
+        .sprite-tile {
+            width: 100%;
+            height: 100%;
+            background-repeat: no-repeat;
+        }
+EXTRA_RULES        /* Display-sized derivatives already have the on-screen size (set by width/height attributes) */
+        .thumbnail-derivative {
+            display: block;
+        }
         /* Style for iframes inside iframe-wrapper (used for direct iframes and fallbacks) */
         .iframe-wrapper iframe {
             width: calc(var(--framewidth) * var(--framemult));
@@ -230,107 +1427,1234 @@ html = """<!DOCTYPE HTML>
     </style>
 </head>
 <body>
-<div class="grid-container">
 """
 
-# Add each iframe block for filtered rows
-if df.empty:
-    print("DEBUG: DataFrame is empty, no dashboard blocks will be added.") # DEBUG PRINT
-else:
-    for index, row in df.iterrows():
-        # --- Title Generation Logic ---
-        title = ""
-        # Check if 'Title' column exists and is not blank
-        if "Title" in df.columns and pd.notna(row["Title"]) and str(row["Title"]).strip() != '':
-            title = str(row["Title"]).strip()
+GRID_OPEN = """<div class="grid-container">
+"""
+
+GRID_CLOSE = """
+</div>
+"""
+
+# Live iframes start as placeholders (data-src, no src). This loader gives them
+# their src only when they come near the viewport, keeps at most MAX_LIVE_IFRAMES
+# of them running (0 = no cap) and unloads the ones scrolled out of view.
+# Pages that render tiles in the browser call liveIframes.observe/reset themselves.
+LIVE_IFRAME_SCRIPT = """<script>
+(function () {
+    var maxLive = MAX_LIVE_IFRAMES;
+    var live = [];
+    var waiting = [];
+    var observer = null;
+    function pump() {
+        while (waiting.length && (maxLive <= 0 || live.length < maxLive)) {
+            var frame = waiting.shift();
+            frame.src = frame.dataset.src;
+            live.push(frame);
+        }
+    }
+    if ('IntersectionObserver' in window) {
+        observer = new IntersectionObserver(function (entries) {
+            entries.forEach(function (entry) {
+                var frame = entry.target;
+                var liveAt = live.indexOf(frame);
+                var waitingAt = waiting.indexOf(frame);
+                if (entry.isIntersecting) {
+                    if (liveAt === -1 && waitingAt === -1) waiting.push(frame);
+                } else {
+                    if (waitingAt !== -1) waiting.splice(waitingAt, 1);
+                    if (liveAt !== -1) {
+                        live.splice(liveAt, 1);
+                        frame.src = 'about:blank';
+                    }
+                }
+            });
+            pump();
+        }, {rootMargin: '200px'});
+    }
+    window.liveIframes = {
+        observe: function (root) {
+            Array.prototype.forEach.call(root.querySelectorAll('iframe[data-src]'), function (frame) {
+                if (observer) observer.observe(frame);
+                else frame.src = frame.dataset.src;
+            });
+        },
+        reset: function () {
+            if (observer) observer.disconnect();
+            live = [];
+            waiting = [];
+        }
+    };
+    window.liveIframes.observe(document);
+})();
+</script>
+"""
+
+PAGE_END = """</body>
+</html>
+"""
+
+TILE_TEMPLATE = """
+        <div class="iframe-wrapper">
+            <div class="iframe-title">{title}</div>
+            <a href="{url}" target="_blank" class="clickable-overlay"></a>
+            {display_content}
+        </div>
+        """
+
+NO_CONTENT = '<div style="background-color:#ccc; color:#666; width:100%; height:100%; display:flex; align-items:center; justify-content:center;">No Content</div>'
+
+# --- Page Building ---
+def parse_filter_args(filter_args):
+    """Turn CLI-style ['Country', 'Mali', 'Season', 'JAS,OND'] into ({column: [values]}, filter_summary)."""
+    filter_dict = {}
+    filter_summary = []
+    it = iter(filter_args or [])
+    for x in it:
+        try:
+            key = x
+            value = next(it)
+            if ',' in value:
+                filter_dict[key] = value.split(',')
+                filter_summary.append(f"{key}_{'_'.join(value.split(','))}")
+            else:
+                filter_dict[key] = [value]
+                filter_summary.append(f"{key}_{value}")
+        except StopIteration:
+            log.warning(f"Missing value for filter key '{x}'. Skipping.")
+            break
+    return filter_dict, filter_summary
+
+def apply_filters(df, filter_dict):
+    """Keep rows whose value in every filtered column matches one of its values, case-insensitively.
+
+    Columns missing from the CSV are skipped (check_filter_columns warns about them once).
+    With a FACET_INDEX loaded, indexed columns are resolved from its bitmaps and
+    only the remaining columns are compared here. df must keep the CSV's row
+    positions as its index (as read_csv gives, chunked or not).
+    """
+    if FACET_INDEX is not None and filter_dict:
+        mask, filter_dict = FACET_INDEX.select(filter_dict)
+        if mask is not None:
+            df = df[mask[df.index.to_numpy()]]
+    for column, values in filter_dict.items():
+        if column in df.columns:
+            # Compare as lowercase strings without converting the shared DataFrame
+            df = df[df[column].astype(str).str.lower().isin([v.lower() for v in values])]
+    return df
+
+class FacetIndex:
+    """Inverted index from lowercase column value to a bitmap of the CSV rows holding it.
+
+    Values are categorical-encoded per column and each bitmap is a Python int
+    with bit i set for row i, so a filter is an OR of value bitmaps within a
+    column and an AND across columns. Columns with more than
+    FACET_INDEX_MAX_VALUES distinct values (URLs, titles, ...) are not indexed.
+    The index is saved to FACET_INDEX_PATH as JSON, bitmaps as hex strings,
+    together with the CSV's hash.
+    """
+
+    VERSION = 2
+
+    def __init__(self, csv_hash, rows, columns, bitmaps):
+        self.csv_hash = csv_hash
+        self.rows = rows
+        self.columns = columns # Every column of the CSV, indexed or not
+        self.bitmaps = bitmaps # {column: {lowercase value: bitmap}}
+        self.masks = {}
+
+    @staticmethod
+    def csv_hash():
+        digest = hashlib.sha256()
+        with open(CSV_PATH, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @classmethod
+    def build(cls, csv_hash):
+        rows = 0
+        columns = []
+        bitmaps = {}
+        for chunk in iter_catalog():
+            if not columns:
+                columns = list(chunk.columns)
+                bitmaps = {column: {} for column in columns}
+            offset = chunk.index[0] if len(chunk) else rows
+            for column in list(bitmaps):
+                codes, values = pd.factorize(chunk[column].astype(str).str.lower())
+                if len(bitmaps[column]) + len(values) > FACET_INDEX_MAX_VALUES:
+                    del bitmaps[column] # Too many distinct values to be worth indexing
+                    continue
+                for code, value in enumerate(values):
+                    bits = np.packbits(codes == code, bitorder="little").tobytes()
+                    bitmap = int.from_bytes(bits, "little") << int(offset)
+                    bitmaps[column][value] = bitmaps[column].get(value, 0) | bitmap
+            rows += len(chunk)
+        return cls(csv_hash, rows, columns, bitmaps)
+
+    @classmethod
+    def load(cls):
+        """The index for the current CSV: read from disk if still valid, otherwise rebuilt and saved."""
+        csv_hash = cls.csv_hash()
+        try:
+            with open(FACET_INDEX_PATH, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved["version"] == cls.VERSION and saved["csv_hash"] == csv_hash:
+                bitmaps = {column: {value: int(bitmap, 16) for value, bitmap in values.items()}
+                           for column, values in saved["bitmaps"].items()}
+                return cls(csv_hash, saved["rows"], saved["columns"], bitmaps)
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            pass
+        started = time.monotonic()
+        index = cls.build(csv_hash)
+        log.debug(f"Built facet index for {index.rows} rows and {len(index.bitmaps)} column(s) in {time.monotonic() - started:.2f}s")
+        try:
+            tmp_path = f"{FACET_INDEX_PATH}.tmp"
+            saved = {
+                "version": cls.VERSION, "csv_hash": csv_hash, "rows": index.rows, "columns": index.columns,
+                "bitmaps": {column: {value: format(bitmap, "x") for value, bitmap in values.items()}
+                            for column, values in index.bitmaps.items()},
+            }
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(saved, f)
+            os.replace(tmp_path, FACET_INDEX_PATH)
+        except OSError as e:
+            log.warning(f"Could not save facet index {FACET_INDEX_PATH}: {e}")
+        return index
+
+    def select(self, filter_dict):
+        """(row mask over the whole CSV or None, filters on unindexed columns still to apply)."""
+        key = tuple((column, tuple(values)) for column, values in filter_dict.items())
+        if key not in self.masks:
+            selection = None
+            residual = {}
+            for column, values in filter_dict.items():
+                if column not in self.bitmaps:
+                    residual[column] = values
+                    continue
+                column_bitmap = 0
+                for value in values:
+                    column_bitmap |= self.bitmaps[column].get(value.lower(), 0)
+                selection = column_bitmap if selection is None else selection & column_bitmap
+            mask = None
+            if selection is not None:
+                bits = np.frombuffer(selection.to_bytes((self.rows + 7) // 8, "little"), dtype=np.uint8)
+                mask = np.unpackbits(bits, bitorder="little")[:self.rows].astype(bool)
+            self.masks[key] = (mask, residual)
+        return self.masks[key]
+
+def check_filter_columns(filter_dict, columns):
+    for column in filter_dict:
+        if column not in columns:
+            log.warning(f"Column '{column}' not found in the CSV. Skipping this filter.")
+
+def iter_catalog():
+    """Yield the catalog as DataFrames: the whole CSV at once, or CSV_CHUNKSIZE rows at a time.
+
+    Reading in chunks keeps memory flat for very large catalogs; every pass over
+    the catalog then re-reads the file.
+    """
+    global CATALOG
+    if CSV_CHUNKSIZE:
+        yield from pd.read_csv(CSV_PATH, chunksize=CSV_CHUNKSIZE)
+        return
+    if CATALOG is None:
+        CATALOG = pd.read_csv(CSV_PATH)
+    yield CATALOG
+
+def page_output_filename(output_filename, filter_summary, direct_iframes):
+    """Output filename for a page: the requested one, or one built from the filters, plus the 'cached' suffix."""
+    if not output_filename:
+        if filter_summary:
+            base_name = "_".join(filter_summary)
+            base_name = re.sub(r'[^\w-]', '', base_name)
+            base_name = re.sub(r'__+', '_', base_name)
+            base_name = base_name.strip('_')
+            output_filename = f"{base_name}_dashboards.html".lower()
         else:
-            # Fallback to dynamic generation if 'Title' column is absent or blank
-            title_parts = []
-            for col in df.columns:
-                if col not in EXCLUDE_FROM_TITLE_COLUMNS and pd.notna(row[col]) and str(row[col]).strip() != '':
-                    title_parts.append(str(row[col]).strip())
-
-            if not title_parts:
-                title = "Untitled Dashboard"
+            output_filename = "all_dashboards.html"
+
+    # --- Add 'cached' to filename if cached option is used and not direct iframes ---
+    # 'cached' suffix implies that thumbnails are being used AND they are not forced to refresh
+    if not args.refresh_thumbnails and not args.refresh_changed and not args.refresh_stale and not direct_iframes:
+        name, ext = os.path.splitext(output_filename)
+        output_filename = f"{name}_cached{ext}"
+        log.info(f"Using cached thumbnails. Output filename will be: {output_filename}")
+    elif direct_iframes:
+        # If direct iframes are used, no cached suffix is relevant
+        log.info("Generating HTML with direct iframe embeds (no thumbnails).")
+    elif args.refresh_changed and not args.refresh_thumbnails:
+        log.info("Generating HTML with thumbnails refreshed where the dashboard changed.")
+    elif args.refresh_stale and not args.refresh_thumbnails:
+        log.info("Generating HTML with thumbnails refreshed where they are older than their TTL.")
+    else: # args.refresh_thumbnails is True
+        log.info("Generating HTML with refreshed thumbnails.")
+    return output_filename
+
+def page_urls(df):
+    """Distinct dashboard URLs of df in row order."""
+    if "CU URL" not in df.columns:
+        return []
+    return [url for url in dict.fromkeys(df["CU URL"].dropna().astype(str)) if url != "#"]
+
+def plan_captures(url_legacy_dirs, refresh_urls=None, ttls=None):
+    """Decide which thumbnails to capture for {url: legacy per-page dir}.
+
+    All of them on a forced refresh, otherwise only the ones missing from the
+    store (after adopting legacy captures), plus, with --refresh-changed, the
+    ones whose page changed since last time, or with --refresh-stale, the ones
+    older than their TTL (ttls: {url: seconds}). A set of refresh_urls (--watch
+    rebuilds) replaces these options: those URLs are recaptured, the rest only
+    if missing. Jobs come out most stale first (missing ones leading), so a
+    --time-budget spends its time where it matters most. URLs that failed
+    recently (see CaptureFailures) are left out unless --retry-failed.
+    Returns (capture_jobs, fresh_validators).
+    """
+    capture_jobs = []
+    cached_jobs = []
+    fresh_validators = {}
+    refresh_all = args.refresh_thumbnails and refresh_urls is None
+    for url, legacy_dir in url_legacy_dirs.items():
+        thumbnail_path = thumbnail_path_for(url)
+        if refresh_all or url in (refresh_urls or ()):
+            capture_jobs.append((url, thumbnail_path))
+        elif not os.path.exists(thumbnail_path) and not adopt_legacy_thumbnail(url, thumbnail_path, legacy_dir):
+            capture_jobs.append((url, thumbnail_path))
+        else:
+            cached_jobs.append((url, thumbnail_path))
+
+    if args.refresh_changed and not args.refresh_thumbnails and refresh_urls is None and url_legacy_dirs:
+        # Validate every URL (including missing ones, to record their validators)
+        log.info(f"Checking {len(url_legacy_dirs)} dashboard(s) for changes...")
+        changed_urls, fresh_validators = find_changed_urls(sorted(url_legacy_dirs), load_validators())
+        changed_urls = set(changed_urls)
+        capture_jobs += [job for job in cached_jobs if job[0] in changed_urls]
+        log.info(f"{len(changed_urls)} dashboard(s) changed; {len(capture_jobs)} thumbnail(s) to capture.")
+
+    if (args.refresh_stale or CAPTURE_DEADLINE is not None) and refresh_urls is None:
+        ttls = ttls or {}
+        capture_times = load_capture_times()
+        now = time.time()
+        url_staleness = {url: staleness(url, ttls.get(url, THUMBNAIL_TTL_DAYS * 86400.0), capture_times, now) for url in url_legacy_dirs}
+        if args.refresh_stale and not args.refresh_thumbnails:
+            capture_urls = {url for url, _ in capture_jobs}
+            stale_jobs = [job for job in cached_jobs if job[0] not in capture_urls and url_staleness[job[0]] >= 1]
+            capture_jobs += stale_jobs
+            log.info(f"{len(stale_jobs)} thumbnail(s) older than their TTL; {len(capture_jobs)} thumbnail(s) to capture.")
+        capture_jobs.sort(key=lambda job: url_staleness[job[0]], reverse=True)
+
+    if capture_jobs and not args.retry_failed:
+        failures = load_capture_failures()
+        now = time.time()
+        known_bad = {url for url, _ in capture_jobs if failures.get(url, {}).get("retry_after", 0) > now}
+        if known_bad:
+            for url in sorted(known_bad):
+                log.debug(f"Failed {failures[url]['failures']} time(s), next try after {time.strftime('%Y-%m-%d %H:%M', time.localtime(failures[url]['retry_after']))}: {url}")
+            log.info(f"Skipping {len(known_bad)} dashboard(s) that failed recently (--retry-failed to try them anyway).")
+            capture_jobs = [job for job in capture_jobs if job[0] not in known_bad]
+    return capture_jobs, fresh_validators
+
+def run_captures(capture_jobs):
+    """Capture all jobs in one browser session with the selected engine."""
+    global WARM_CDP_BROWSER
+    CAPTURE_STATS.update(started=time.monotonic(), done=0, changed=0, unchanged=0)
+    PHASHES.update(load_phashes())
+    PLAIN_KEYS.clear()
+    PLAIN_KEYS.update(load_plain_keys())
+    plain_keys = set(PLAIN_KEYS)
+    CAPTURE_FAILURES.start()
+    if capture_jobs and not within_time_budget():
+        # Not even worth starting a browser
+        log.info(f"Time budget reached; {len(capture_jobs)} thumbnail(s) left for the next run.")
+    elif capture_jobs and args.engine == "cdp":
+        log.info(f"Capturing {len(capture_jobs)} thumbnail(s) with {max(1, min(args.workers, len(capture_jobs)))} tab(s) of one headless browser...")
+        profile = None
+        try:
+            import cdp_capture
+            engine = cdp_capture
+            if KEEP_DRIVERS:
+                if WARM_CDP_BROWSER is None:
+                    WARM_CDP_BROWSER = cdp_capture.WarmBrowser()
+                    BROWSER_PROFILES[WARM_CDP_BROWSER] = claim_profile()
+                engine = WARM_CDP_BROWSER
             else:
-                title = " ".join(title_parts).strip()
+                profile = claim_profile()
+            engine.capture_thumbnails(
+                capture_jobs, store_capture, tabs=args.workers,
+                width=THUMBNAIL_WIDTH, height=THUMBNAIL_HEIGHT,
+                init_script=READY_INIT_SCRIPT, probe_script=READY_PROBE_SCRIPT,
+                quiet_window=READY_QUIET_WINDOW, max_wait=READY_MAX_WAIT,
+                page_load_timeout=PAGE_LOAD_WAIT_TIME, poll_interval=READY_POLL_INTERVAL,
+                keep_going=within_time_budget, report=RUN_REPORT, failures=CAPTURE_FAILURES,
+                scheduler=HostScheduler(capture_jobs, args.per_host, args.host_interval),
+                clips={url: capture_clip(url) for url, _ in capture_jobs if clip_for(url) is not None},
+                profile_dir=BROWSER_PROFILES.get(engine, profile), cache_size=BROWSER_CACHE_MAX_MB * 2 ** 20,
+            )
+        except Exception as e:
+            log.error(f"Could not run CDP capture engine: {e}")
+            log.warning("Thumbnails that were not captured will fall back to iframes.")
+        finally:
+            release_profile(profile)
+    elif capture_jobs:
+        log.info(f"Capturing {len(capture_jobs)} thumbnail(s) with {max(1, min(args.workers, len(capture_jobs)))} headless browser(s)...")
+        capture_thumbnails(capture_jobs, args.workers)
+    if capture_jobs:
+        CAPTURE_FAILURES.save()
+    if CAPTURED_AT:
+        save_capture_times(CAPTURED_AT)
+    if PHASHES:
+        save_phashes(PHASHES)
+    if PLAIN_KEYS != plain_keys:
+        save_plain_keys(PLAIN_KEYS)
+    if CAPTURE_STATS["done"]:
+        log.info(f"{CAPTURE_STATS['changed']} thumbnail(s) changed; {CAPTURE_STATS['unchanged']} looked the same as before and were kept.")
+
+def record_validators(capture_jobs, fresh_validators):
+    """Remember validators only for captures that are now current: URLs that were
+    unchanged, or that were captured successfully this run."""
+    if not fresh_validators:
+        return
+    validators = load_validators()
+    capture_urls = {url for url, _ in capture_jobs}
+    for url, url_validators in fresh_validators.items():
+        if url not in capture_urls or url in CAPTURED_URLS:
+            validators[url] = url_validators
+    save_validators(validators)
+
+def row_titles(df):
+    """Title of every row of df: the Title column if set, otherwise the row's descriptive columns joined together."""
+    def cleaned(column):
+        return df[column].astype(str).str.strip().where(df[column].notna(), "")
+    # Fallback to dynamic generation if 'Title' column is absent or blank
+    fallback = pd.Series("", index=df.index, dtype=object)
+    for col in df.columns:
+        if col in EXCLUDE_FROM_TITLE_COLUMNS:
+            continue
+        part = cleaned(col)
+        fallback = fallback.where(part == "", (fallback + " " + part).str.lstrip())
+    fallback = fallback.where(fallback != "", "Untitled Dashboard")
+    if "Title" not in df.columns:
+        return fallback
+    title = cleaned("Title")
+    return title.where(title != "", fallback)
+
+def page_sprites(urls, direct_iframes=False, sprite=False):
+    """Sprite atlases for a page showing urls: (positions, atlases), empty unless --sprite applies."""
+    if not sprite or direct_iframes:
+        return {}, []
+    if Image is None:
+        log.warning("--sprite needs Pillow; drawing tiles from individual thumbnails instead.")
+        return {}, []
+    paths = {url: thumbnail_path_for(url) for url in urls}
+    sprite_members = [path for path in paths.values() if os.path.exists(path)]
+    if not sprite_members:
+        return {}, []
+    return build_sprites(sprite_members, {path for url, path in paths.items() if clip_for(url) is not None})
+
+def live_iframe_script():
+    return LIVE_IFRAME_SCRIPT.replace("MAX_LIVE_IFRAMES", str(MAX_LIVE_IFRAMES))
+
+def page_head(extra_css=""):
+    return (PAGE_HEAD.replace("FRAME_WIDTHpx", f"{FRAME_WIDTH}px").replace("FRAME_RATIO_W2H", f"{FRAME_RATIO_W2H:.4f}")
+            .replace("EXTRA_RULES", extra_css))
+
+def tile_frame(df, direct_iframes=False):
+    """Columnar stage of rendering: one row per row of df with everything its tile needs.
+
+    Columns are title, url ("#" if none), key (store key, "" if no url), path
+    (stored PNG, "" if not captured), src and srcset ("" if none; src is the 1x
+    derivative when the display derivatives exist, else the PNG itself).
+    """
+    tiles = pd.DataFrame({"title": row_titles(df)}, index=df.index)
+    if "CU URL" in df.columns:
+        tiles["url"] = df["CU URL"].astype(str).where(df["CU URL"].notna(), "#")
+    else:
+        tiles["url"] = "#"
+    tiles["key"] = tiles["path"] = tiles["src"] = tiles["srcset"] = ""
+    if direct_iframes or tiles.empty:
+        return tiles
 
-        url = row["CU URL"] if "CU URL" in df.columns and pd.notna(row["CU URL"]) else "#"
+    urls = tiles["url"]
+    keys = {url: thumbnail_key(url) for url in urls.unique() if url != "#"}
+    key = urls.map(keys).fillna("")
+    tiles["key"] = key
+    # One directory listing answers every existence check for the chunk
+    stored = set(os.listdir(THUMBNAIL_STORE_DIR)) if os.path.isdir(THUMBNAIL_STORE_DIR) else set()
+    prefix = THUMBNAIL_STORE_DIR + os.sep # The store path is relative to the working directory, i.e. to the HTML file
+    has_png = (key != "") & (key + ".png").isin(stored)
+    tiles["path"] = (prefix + key + ".png").where(has_png, "")
 
+    has_derivatives = pd.Series(False, index=df.index)
+    if Image is not None and has_png.any():
+        suffixes = derivative_suffixes()
+        has_derivatives = has_png.copy()
+        for _, suffix in suffixes:
+            has_derivatives &= (key + "." + suffix).isin(stored)
+        # Backfill derivatives for thumbnails captured before they existed
+        clipped_keys = {keys[url] for url in keys if clip_for(url) is not None}
+        for missing_key in key[has_png & ~has_derivatives].unique():
+            if ensure_derivatives(prefix + missing_key + ".png", missing_key in clipped_keys):
+                has_derivatives |= key == missing_key
+        candidates = [prefix + key + "." + suffix + f" {density}x" for density, suffix in suffixes]
+        srcset = candidates[0]
+        for candidate in candidates[1:]:
+            srcset = srcset + ", " + candidate
+        tiles["srcset"] = srcset.where(has_derivatives, "")
+        tiles["src"] = (prefix + key + "." + suffixes[0][1]).where(has_derivatives, tiles["path"])
+    else:
+        tiles["src"] = tiles["path"]
+    return tiles
+
+def render_tiles(df, direct_iframes=False, sprite_positions=None):
+    """Yield the markup of one tile per row of df, from the thumbnails now in the store."""
+    sprite_positions = sprite_positions or {}
+    tiles = tile_frame(df, direct_iframes)
+    width, height = tile_size()
+    debug = log.isEnabledFor(logging.DEBUG) # Checked once: the per-row messages below are costly to format
+    # Everything is computed per column above; this loop only formats markup
+    for index, title, url, thumbnail_path, thumbnail_src, srcset in zip(
+            tiles.index, tiles["title"], tiles["url"], tiles["path"], tiles["src"], tiles["srcset"]):
         display_content = ""
-        if args.direct_iframes:
+        if direct_iframes:
             # Mode: Direct Iframes with old scaling formatting
             if url != '#':
-                display_content = f'<iframe src="{url}"></iframe>'
+                display_content = f'<iframe data-src="{url}" loading="lazy"></iframe>'
             else:
-                display_content = '<div style="background-color:#ccc; color:#666; width:100%; height:100%; display:flex; align-items:center; justify-content:center;">No Content</div>'
+                display_content = NO_CONTENT
         else:
-            # Mode: Thumbnails (cached or refreshed)
-            thumbnail_src = ""
-            # Use CURRENT_THUMBNAIL_DIR for saving/loading thumbnails
-            if driver and url != "#": # Only try to generate if driver is initialized and URL is valid
-                url_hash = hashlib.md5(url.encode('utf-8')).hexdigest()
-                thumbnail_filename = f"{url_hash}.png"
-                thumbnail_path = os.path.join(CURRENT_THUMBNAIL_DIR, thumbnail_filename)
-
-                if args.refresh_thumbnails or not os.path.exists(thumbnail_path):
-                    try:
-                        print(f"DEBUG: Generating thumbnail for: {url}") # DEBUG PRINT
-                        driver.get(url)
-                        WebDriverWait(driver, PAGE_LOAD_WAIT_TIME).until(
-                            EC.presence_of_element_located((By.TAG_NAME, "body"))
-                        )
-                        time.sleep(POST_LOAD_SLEEP_TIME)
-
-                        driver.save_screenshot(thumbnail_path)
-                        print(f"DEBUG: Thumbnail saved: {thumbnail_path}") # DEBUG PRINT
-
-                    except Exception as e:
-                        print(f"ERROR: Could not generate thumbnail for {url}: {e}") # DEBUG PRINT
-                        thumbnail_path = None
-                
-                if thumbnail_path and os.path.exists(thumbnail_path):
-                    # CORRECTED: Use THUMBNAIL_BASE_DIR AND thumbnail_subdir_name for the HTML src attribute to make it relative to the HTML file
-                    thumbnail_src = os.path.join(THUMBNAIL_BASE_DIR, thumbnail_subdir_name, thumbnail_filename)
-                    print(f"DEBUG: Thumbnail SRC in HTML will be: {thumbnail_src}") # DEBUG PRINT
-            
-            if thumbnail_src:
-                display_content = f'<img src="{thumbnail_src}" alt="{title}" class="thumbnail-image">'
+            # Mode: Thumbnails (cached or refreshed); captures happened before the pages are built
+            sprite_position = sprite_positions.get(thumbnail_path) if thumbnail_path else None # Set when drawn from the page's sprite atlas
+            if debug and thumbnail_src and not sprite_position:
+                log.debug(f"Thumbnail SRC in HTML will be: {thumbnail_src}")
+
+            if sprite_position:
+                atlas_index, x, y = sprite_position
+                display_content = f'<div class="sprite-tile sprite-{atlas_index}" style="background-position: -{x}px -{y}px;" role="img" aria-label="{title}"></div>'
+            elif srcset:
+                display_content = f'<img src="{thumbnail_src}" srcset="{srcset}" width="{width}" height="{height}" alt="{title}" loading="lazy" decoding="async" class="thumbnail-derivative">'
+            elif thumbnail_src:
+                display_content = f'<img src="{thumbnail_src}" alt="{title}" loading="lazy" decoding="async" class="thumbnail-image">'
             elif url != '#':
-                print(f"DEBUG: Falling back to iframe for {url} due to missing/failed thumbnail or driver issue.") # DEBUG PRINT
-                display_content = f'<iframe src="{url}"></iframe>' # Fallback uses direct iframe without extra class
+                if debug:
+                    log.debug(f"Falling back to iframe for {url} due to missing/failed thumbnail or browser issue.")
+                display_content = f'<iframe data-src="{url}" loading="lazy"></iframe>' # Fallback uses a live iframe without extra class
             else:
-                display_content = '<div style="background-color:#ccc; color:#666; width:100%; height:100%; display:flex; align-items:center; justify-content:center;">No Content</div>'
+                display_content = NO_CONTENT
 
-        print(f"DEBUG: Processing row {index}, Title: '{title}', URL: '{url}'. Display content starts with: '{display_content[:50]}...'") # DEBUG PRINT
-        html += f"""
-        <div class="iframe-wrapper">
-            <div class="iframe-title">{title}</div>
-            <a href="{url}" target="_blank" class="clickable-overlay"></a>
-            {display_content}
-        </div>
-        """
+        if debug:
+            log.debug(f"Processing row {index}, Title: '{title}', URL: '{url}'. Display content starts with: '{display_content[:50]}...'")
+        yield TILE_TEMPLATE.format(title=title, url=url, display_content=display_content)
 
-# Close WebDriver
-if driver:
-    print("Closing browser.")
-    driver.quit()
+def write_atomic(path, text):
+    """Write text to path via a temporary file, so readers never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
 
-# Close HTML
-html += """
-</div>
-</body>
-</html>
+class PageWriter:
+    """Streams one output page to disk: head on open, tiles as they are rendered, foot on close."""
+
+    def __init__(self, output_filename, direct_iframes=False, sprite_positions=None, sprite_atlases=()):
+        self.output_filename = output_filename
+        self.direct_iframes = direct_iframes
+        self.sprite_positions = sprite_positions
+        self.length = 0
+        self.tiles = 0
+        # Written beside the page and moved over it on close, so a failed build never leaves half a page
+        self.tmp_filename = f"{output_filename}.{os.getpid()}.tmp"
+        self.outputs = [output_filename] + [path for paths, _, _ in sprite_atlases for path in paths.values()]
+        self.file = open(self.tmp_filename, "w", encoding="utf-8")
+        self.write(page_head(sprite_css(sprite_atlases)) + GRID_OPEN)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.length += len(chunk)
+
+    def write_rows(self, df):
+        for tile in render_tiles(df, self.direct_iframes, self.sprite_positions):
+            self.write(tile)
+            self.tiles += 1
+
+    def close(self):
+        self.write(GRID_CLOSE + live_iframe_script() + PAGE_END)
+        self.file.close()
+        os.replace(self.tmp_filename, self.output_filename)
+        log.debug(f"HTML content length written: {self.length}")
+        if self.tiles == 0:
+            log.warning("Generated HTML has no dashboard blocks, it might be empty or nearly empty.")
+        log.info(f"Generated {self.output_filename}")
+
+# --- Faceted Browser Page ---
+# One page that filters a JSON index of the catalog in the browser (--faceted).
+FACETED_CSS = """        .facet-bar {
+            display: flex;
+            flex-wrap: wrap;
+            gap: 10px;
+            padding: 10px;
+            font-family: sans-serif;
+            font-size: 14px;
+        }
+        .facet-bar fieldset {
+            border: 1px solid #ccc;
+            border-radius: 8px;
+            max-height: 160px;
+            overflow-y: auto;
+        }
+        .facet-bar label {
+            display: block;
+            white-space: nowrap;
+        }
+        .facet-count {
+            color: #666;
+        }
+        .result-count {
+            padding: 0 10px;
+            font-family: sans-serif;
+        }
+"""
+
+FACETED_BODY = """<form class="facet-bar" id="facets"></form>
+<div class="result-count" id="result-count">Loading dashboards...</div>
+<div class="grid-container" id="results"></div>
+<div id="more-results"></div>
 """
 
-# Save to file using the determined filename
-print(f"DEBUG: HTML content length before writing: {len(html)}") # DEBUG PRINT
-if len(html) < 200: # A very rough check for "empty" content beyond boilerplate
-    print("WARNING: Generated HTML content appears unusually short, it might be empty or nearly empty.") # DEBUG PRINT
+FACETED_SCRIPT = """<script>
+(function () {
+    var INDEX_URL = INDEX_URL_JSON;
+    var NO_CONTENT = NO_CONTENT_JSON;
+    var BATCH_SIZE = FACET_BATCH_SIZE;
+    var form = document.getElementById('facets');
+    var grid = document.getElementById('results');
+    var summary = document.getElementById('result-count');
+    var sentinel = document.getElementById('more-results');
+    var index = null;
+    var selected = [];
+    var matches = [];
+    var shown = 0;
+
+    function escapeHtml(text) {
+        return String(text).replace(/[&<>"']/g, function (c) {
+            return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c];
+        });
+    }
+
+    function tile(row) {
+        var title = escapeHtml(row.t);
+        var url = escapeHtml(row.u || '#');
+        var content = NO_CONTENT;
+        var thumbs = index.thumbnails;
+        if (row.k) {
+            var base = thumbs.dir + '/' + row.k + '.';
+            var srcset = thumbs.derivatives.map(function (d) { return base + d[1] + ' ' + d[0] + 'x'; }).join(', ');
+            content = '<img src="' + base + thumbs.derivatives[0][1] + '" srcset="' + srcset + '" width="' + thumbs.width +
+                '" height="' + thumbs.height + '" alt="' + title + '" loading="lazy" decoding="async" class="thumbnail-derivative">';
+        } else if (row.p) {
+            content = '<img src="' + escapeHtml(row.p) + '" alt="' + title + '" loading="lazy" decoding="async" class="thumbnail-image">';
+        } else if (row.u) {
+            content = '<iframe data-src="' + url + '" loading="lazy"></iframe>';
+        }
+        return '<div class="iframe-wrapper"><div class="iframe-title">' + title + '</div>' +
+            '<a href="' + url + '" target="_blank" class="clickable-overlay"></a>' + content + '</div>';
+    }
+
+    // A row matches when, for every facet with a selection (except `skip`), its value is selected
+    function matchesSelection(row, skip) {
+        for (var i = 0; i < selected.length; i++) {
+            if (i !== skip && selected[i].length && selected[i].indexOf(row.f[i]) === -1) return false;
+        }
+        return true;
+    }
+
+    function buildControls() {
+        var html = '';
+        index.facets.forEach(function (facet, i) {
+            html += '<fieldset><legend>' + escapeHtml(facet.name) + '</legend>';
+            facet.values.forEach(function (value, v) {
+                html += '<label><input type="checkbox" data-facet="' + i + '" value="' + v + '"> ' +
+                    escapeHtml(value || '(none)') + ' <span class="facet-count" id="count-' + i + '-' + v + '"></span></label>';
+            });
+            html += '</fieldset>';
+        });
+        form.innerHTML = html;
+    }
+
+    function updateCounts() {
+        index.facets.forEach(function (facet, i) {
+            var counts = facet.values.map(function () { return 0; });
+            index.rows.forEach(function (row) { if (matchesSelection(row, i)) counts[row.f[i]]++; });
+            counts.forEach(function (count, v) {
+                document.getElementById('count-' + i + '-' + v).textContent = '(' + count + ')';
+            });
+        });
+    }
+
+    function showMore() {
+        while (shown < matches.length) {
+            grid.insertAdjacentHTML('beforeend', matches.slice(shown, shown + BATCH_SIZE).map(tile).join(''));
+            shown = Math.min(matches.length, shown + BATCH_SIZE);
+            if (sentinel.getBoundingClientRect().top > window.innerHeight + 400) break;
+        }
+        window.liveIframes.observe(grid);
+    }
+
+    function apply() {
+        matches = index.rows.filter(function (row) { return matchesSelection(row, -1); });
+        window.liveIframes.reset();
+        grid.innerHTML = '';
+        shown = 0;
+        showMore();
+        summary.textContent = matches.length + ' of ' + index.rows.length + ' dashboards';
+        updateCounts();
+    }
+
+    // The selection lives in the URL hash, e.g. #Region=West%20Africa&Public=Unlocked,Locked
+    function readHash() {
+        var params = {};
+        location.hash.replace(/^#/, '').split('&').forEach(function (part) {
+            var pair = part.split('=');
+            if (pair.length === 2) params[decodeURIComponent(pair[0])] = pair[1].split(',').map(decodeURIComponent);
+        });
+        selected = index.facets.map(function (facet) {
+            return (params[facet.name] || []).map(function (value) { return facet.values.indexOf(value); })
+                .filter(function (v) { return v !== -1; });
+        });
+        Array.prototype.forEach.call(form.querySelectorAll('input'), function (box) {
+            box.checked = selected[box.dataset.facet].indexOf(Number(box.value)) !== -1;
+        });
+    }
+
+    function writeHash() {
+        var parts = [];
+        index.facets.forEach(function (facet, i) {
+            if (selected[i].length) {
+                parts.push(encodeURIComponent(facet.name) + '=' +
+                    selected[i].map(function (v) { return encodeURIComponent(facet.values[v]); }).join(','));
+            }
+        });
+        history.replaceState(null, '', parts.length ? '#' + parts.join('&') : location.pathname + location.search);
+    }
+
+    form.addEventListener('change', function (event) {
+        var box = event.target;
+        var values = selected[box.dataset.facet];
+        var value = Number(box.value);
+        if (box.checked && values.indexOf(value) === -1) values.push(value);
+        if (!box.checked && values.indexOf(value) !== -1) values.splice(values.indexOf(value), 1);
+        writeHash();
+        apply();
+    });
+    window.addEventListener('hashchange', function () { readHash(); apply(); });
+
+    if ('IntersectionObserver' in window) {
+        new IntersectionObserver(function (entries) {
+            if (entries[0].isIntersecting && index) showMore();
+        }, {rootMargin: '400px'}).observe(sentinel);
+    } else {
+        BATCH_SIZE = Infinity;
+    }
+
+    fetch(INDEX_URL).then(function (response) {
+        if (!response.ok) throw new Error(response.status + ' ' + response.statusText);
+        return response.json();
+    }).then(function (data) {
+        index = data;
+        buildControls();
+        readHash();
+        apply();
+    }).catch(function (error) {
+        summary.textContent = 'Could not load ' + INDEX_URL + ': ' + error.message;
+    });
+})();
+</script>
+"""
+
+class FacetedPageWriter:
+    """Collects rows into a compact JSON index and writes it with a page that filters it in the browser.
+
+    Each row is {"t": title, "u": url, "k": store key (display derivatives) or
+    "p": thumbnail path (full PNG), "f": [index into each facet's values]}.
+    """
+
+    def __init__(self, output_filename, direct_iframes=False):
+        self.output_filename = output_filename
+        self.index_filename = f"{os.path.splitext(output_filename)[0]}.json"
+        self.direct_iframes = direct_iframes
+        self.outputs = [output_filename, self.index_filename]
+        self.facets = None
+        self.rows = []
+
+    def write_rows(self, df):
+        if self.facets is None:
+            self.facets = [(column, {}) for column in FACET_COLUMNS if column in df.columns]
+        tiles = tile_frame(df, self.direct_iframes)
+        # Per-chunk codes of each facet column, mapped onto the codes seen in earlier chunks
+        facet_codes = []
+        for column, values in self.facets:
+            codes, uniques = pd.factorize(df[column].astype(str).str.strip().where(df[column].notna(), ""))
+            known = np.array([values.setdefault(value, len(values)) for value in uniques], dtype=np.int64)
+            facet_codes.append(known[codes].tolist() if len(uniques) else [])
+        for i, (title, url, key, thumbnail_src, srcset) in enumerate(zip(
+                tiles["title"], tiles["url"], tiles["key"], tiles["src"], tiles["srcset"])):
+            entry = {"t": title, "u": url if url != "#" else ""}
+            if srcset:
+                entry["k"] = key
+            elif thumbnail_src:
+                entry["p"] = thumbnail_src.replace(os.sep, "/")
+            entry["f"] = [codes[i] for codes in facet_codes]
+            self.rows.append(entry)
+
+    def close(self):
+        # Facet values are listed sorted; remap the row indexes accordingly
+        facets = []
+        for i, (column, values) in enumerate(self.facets or []):
+            ordered = sorted(values)
+            remap = {values[value]: position for position, value in enumerate(ordered)}
+            for entry in self.rows:
+                entry["f"][i] = remap[entry["f"][i]]
+            facets.append({"name": column, "values": ordered})
+        width, height = tile_size()
+        store_dir = THUMBNAIL_STORE_DIR.replace(os.sep, "/")
+        derivatives = [[density, suffix] for density, suffix in derivative_suffixes()]
+        index = {
+            "facets": facets,
+            "thumbnails": {"dir": store_dir, "derivatives": derivatives, "width": width, "height": height},
+            "rows": self.rows,
+        }
+        write_atomic(self.index_filename, json.dumps(index, separators=(",", ":")))
+
+        script = (FACETED_SCRIPT
+                  .replace("INDEX_URL_JSON", json.dumps(os.path.basename(self.index_filename)))
+                  .replace("NO_CONTENT_JSON", json.dumps(NO_CONTENT))
+                  .replace("FACET_BATCH_SIZE", str(FACET_BATCH_SIZE)))
+        write_atomic(self.output_filename, page_head(FACETED_CSS) + FACETED_BODY + live_iframe_script() + script + PAGE_END)
+        log.info(f"Generated {self.output_filename} and {self.index_filename} ({len(self.rows)} dashboards)")
+
+def load_manifest(path):
+    """Read a batch manifest into page specs.
+
+    The manifest is YAML (JSON if the file ends in .json) with a list of pages,
+    each with an optional `filter` mapping of column to value(s), an optional
+    `output` filename and optional `direct_iframes` / `sprite` / `faceted` overrides:
+
+        pages:
+          - output: all_dashboards.html
+          - filter: {Region: West Africa, Type: [Design Dashboard, Public Monitoring Dashboard]}
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            manifest = json.load(f)
+        else:
+            import yaml
+            manifest = yaml.safe_load(f)
+    pages = manifest.get("pages", []) if isinstance(manifest, dict) else manifest
+    specs = []
+    for page in pages or []:
+        filter_args = []
+        for column, values in (page.get("filter") or {}).items():
+            values = values if isinstance(values, list) else [values]
+            filter_args += [column, ",".join(str(v) for v in values)]
+        specs.append({
+            "filter": filter_args,
+            "output": page.get("output"),
+            "direct_iframes": page.get("direct_iframes", args.direct_iframes),
+            "sprite": page.get("sprite", args.sprite),
+            "faceted": page.get("faceted", args.faceted),
+        })
+    return specs
+
+# --- Incremental Builds ---
+# A page is rewritten only when something it is built from changed since the
+# last build recorded in BUILD_MANIFEST_PATH: its matching CSV rows, the stored
+# thumbnails it points at, or the templates and settings it is rendered with.
+def load_build_manifest():
+    """Read the per-page build records, or return an empty manifest."""
+    try:
+        with open(BUILD_MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_build_manifest(builds):
+    os.makedirs(os.path.dirname(BUILD_MANIFEST_PATH), exist_ok=True)
+    write_atomic(BUILD_MANIFEST_PATH, json.dumps(builds, indent=1, sort_keys=True))
 
+def template_version(page):
+    """Hash of the templates, page options and render settings that shape page."""
+    settings = [
+        TEMPLATE_VERSION, PAGE_HEAD, GRID_OPEN, GRID_CLOSE, LIVE_IFRAME_SCRIPT, PAGE_END, TILE_TEMPLATE, NO_CONTENT,
+        FACETED_CSS, FACETED_BODY, FACETED_SCRIPT, EXCLUDE_FROM_TITLE_COLUMNS, FACET_COLUMNS, FACET_BATCH_SIZE,
+        render_params(), THUMBNAIL_STORE_DIR, FRAME_WIDTH, FRAME_HEIGHT, FRAME_MULT, FRAME_SCALE, FRAME_RATIO_W2H,
+        MAX_LIVE_IFRAMES, DERIVATIVE_FORMAT, DERIVATIVE_DENSITIES, SPRITE_MAX_TILES, SPRITE_COLUMNS, Image is not None,
+        page["direct_iframes"], page["sprite"], page["faceted"],
+    ]
+    return hashlib.sha256(json.dumps(settings).encode('utf-8')).hexdigest()
+
+def hash_rows(digest, df):
+    """Feed the contents of df's rows (not their positions in the CSV) into digest."""
+    digest.update(json.dumps(list(map(str, df.columns))).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+
+def thumbnail_signature(urls):
+    """Hash of the size and mtime of every stored file (PNG and derivatives) the urls point at."""
+    suffixes = ["png"] + [suffix for _, suffix in derivative_suffixes()]
+    digest = hashlib.sha256()
+    for url in urls:
+        key = thumbnail_key(url)
+        for suffix in suffixes:
+            try:
+                stat = os.stat(os.path.join(THUMBNAIL_STORE_DIR, f"{key}.{suffix}"))
+                digest.update(f"{key}.{suffix}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+            except OSError:
+                digest.update(f"{key}.{suffix}:missing\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def page_inputs(page):
+    """What page is built from: {"template", "rows", "thumbnails"} hashes."""
+    return {
+        "template": template_version(page),
+        "rows": page["row_hash"].hexdigest(),
+        "thumbnails": "" if page["direct_iframes"] else thumbnail_signature(page["urls"]),
+    }
+
+def rebuild_reason(inputs, previous):
+    """Why a page with these inputs must be rewritten given its previous build record, or None if it is up to date."""
+    if not previous:
+        return "not built before"
+    missing = [path for path in previous.get("outputs", []) if not os.path.exists(path)]
+    if missing:
+        return f"{missing[0]} is missing"
+    if previous.get("template") != inputs["template"]:
+        return "template or settings changed"
+    if previous.get("rows") != inputs["rows"]:
+        return "matching CSV rows changed"
+    if previous.get("thumbnails") != inputs["thumbnails"]:
+        return "thumbnails changed"
+    return None
+
+def page_files(page, sprite_atlases=()):
+    """The generated files page points at besides the stored PNGs, for its build record:
+    {"sprites": atlas paths, "derivatives": derivative suffixes}."""
+    uses_derivatives = not page["direct_iframes"] and Image is not None
+    return {
+        "sprites": sorted(path for atlas_paths, _, _ in sprite_atlases for path in atlas_paths.values()),
+        "derivatives": [suffix for _, suffix in derivative_suffixes()] if uses_derivatives else [],
+    }
+
+def prune_unreferenced(builds, since):
+    """Delete the sprite atlases and display derivatives no page in builds points at any more.
+
+    Atlases are named after their contents and derivatives after the tile size, so
+    every changed thumbnail or setting leaves files behind that would otherwise be
+    published forever. Records of pages whose output is gone do not count, and
+    files written after since (epoch seconds; e.g. by another run) are kept.
+    Nothing is deleted while a page's record predates page_files.
+    """
+    records = [record for record in builds.values() if all(os.path.exists(path) for path in record.get("outputs", []))]
+    if any("sprites" not in record or "derivatives" not in record for record in records):
+        log.debug("Not pruning sprites or derivatives: some pages were built before their files were recorded.")
+        return
+    sprites = {path for record in records for path in record["sprites"]}
+    suffixes = {suffix for record in records for suffix in record["derivatives"]}
+    candidates = []
+    if os.path.isdir(SPRITE_DIR):
+        candidates += [os.path.join(SPRITE_DIR, name) for name in os.listdir(SPRITE_DIR)
+                       if re.fullmatch(r"[0-9a-f]{32}@\d+x\.(webp|jpg)", name) and os.path.join(SPRITE_DIR, name) not in sprites]
+    if os.path.isdir(THUMBNAIL_STORE_DIR):
+        for name in os.listdir(THUMBNAIL_STORE_DIR):
+            match = re.fullmatch(r"[0-9a-f]{32}\.(\d+(?:w|x\d+)\.(?:webp|jpg))", name) # Derivative names old and new
+            if match and match.group(1) not in suffixes:
+                candidates.append(os.path.join(THUMBNAIL_STORE_DIR, name))
+    removed = 0
+    for path in candidates:
+        try:
+            if os.stat(path).st_mtime < since:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        log.info(f"Removed {removed} sprite atlas(es) and derivative(s) no page uses any more.")
+
+# --- Building Pages ---
+def start_run():
+    """Reset the state kept for one run: each --watch rebuild gets its own report,
+    capture records and --time-budget."""
+    global RUN_REPORT, CAPTURE_DEADLINE
+    RUN_REPORT = RunReport()
+    with CAPTURED_URLS_LOCK:
+        CAPTURED_URLS.clear()
+        CAPTURED_AT.clear()
+    CAPTURE_DEADLINE = None if args.time_budget is None else time.monotonic() + args.time_budget
+
+def build_pages(pages, refresh_urls=None):
+    """Build every page: read the CSV for each page's rows and URLs, capture what
+    is missing, then rewrite the pages whose inputs changed.
+
+    refresh_urls is passed on to plan_captures. Returns the number of pages rewritten.
+    """
+    global FACET_INDEX
+    start_run()
+    ttls = {}
+    URL_CLIPS.clear()
+    for page in pages:
+        page["urls"] = {}
+        page["rows"] = 0
+        page["row_hash"] = hashlib.sha256()
+
+    # Filters are resolved through the facet index (built once per CSV version)
+    if FACET_INDEX is None and any(page["filter_dict"] for page in pages):
+        FACET_INDEX = FacetIndex.load()
+
+    # First pass over the CSV: count each page's rows and collect its URLs
+    columns_checked = False
+    pass_started = time.perf_counter()
+    for chunk in iter_catalog():
+        if not columns_checked:
+            for page in pages:
+                check_filter_columns(page["filter_dict"], chunk.columns)
+            columns_checked = True
+        for url, spec in url_clips(chunk).items():
+            URL_CLIPS.setdefault(url, spec)
+        if args.refresh_stale or CAPTURE_DEADLINE is not None:
+            for url, ttl in url_ttls(chunk).items():
+                ttls[url] = min(ttl, ttls.get(url, ttl))
+        for page in pages:
+            with RUN_REPORT.span("filter", page=page["output_filename"]):
+                page_rows = apply_filters(chunk, page["filter_dict"])
+            page["rows"] += len(page_rows)
+            hash_rows(page["row_hash"], page_rows)
+            page["urls"].update(dict.fromkeys(page_urls(page_rows)))
+    RUN_REPORT.add("catalog pass", time.perf_counter() - pass_started)
+    for page in pages:
+        log.debug(f"{page['output_filename']}: {page['rows']} row(s) after filters")
+
+    # --- Thumbnail Generation Logic ---
+    # All pages share THUMBNAIL_STORE_DIR; each page's old per-page folder
+    # (e.g. "all_dashboards_cached.html" -> "thumbnails/all_dashboards_cached/")
+    # is only consulted to adopt captures made before the shared store existed.
+    # The union of URLs over all pages is captured once, then every page is written.
+    url_legacy_dirs = {}
+    for page in pages:
+        if page["direct_iframes"]:
+            continue
+        legacy_dir = os.path.join(THUMBNAIL_BASE_DIR, os.path.splitext(page["output_filename"])[0])
+        for url in page["urls"]:
+            url_legacy_dirs.setdefault(url, legacy_dir)
+
+    if url_legacy_dirs:
+        os.makedirs(THUMBNAIL_STORE_DIR, exist_ok=True)
+        log.debug(f"Thumbnails will be stored in: {os.path.abspath(THUMBNAIL_STORE_DIR)}")
+
+    with RUN_REPORT.span("plan captures"):
+        capture_jobs, fresh_validators = plan_captures(url_legacy_dirs, refresh_urls, ttls)
+    with RUN_REPORT.span("captures"):
+        run_captures(capture_jobs)
+    record_validators(capture_jobs, fresh_validators)
+
+    # Skip pages whose inputs match their last build
+    builds = load_build_manifest()
+    for page in pages:
+        page["inputs"] = page_inputs(page)
+        page["reason"] = "--rebuild-all" if args.rebuild_all else rebuild_reason(page["inputs"], builds.get(page["output_filename"]))
+        if page["reason"]:
+            log.info(f"Rebuilding {page['output_filename']}: {page['reason']}")
+        else:
+            log.info(f"Up to date: {page['output_filename']}")
+
+    # Second pass: stream every changed page's tiles straight into its output file
+    writers = []
+    for page in pages:
+        if not page["reason"]:
+            continue
+        try:
+            if page["faceted"]:
+                page["files"] = page_files(page)
+                writer = FacetedPageWriter(page["output_filename"], page["direct_iframes"])
+            else:
+                with RUN_REPORT.span("sprites", page=page["output_filename"]):
+                    sprite_positions, sprite_atlases = page_sprites(page["urls"], page["direct_iframes"], page["sprite"])
+                page["files"] = page_files(page, sprite_atlases)
+                writer = PageWriter(page["output_filename"], page["direct_iframes"], sprite_positions, sprite_atlases)
+            writers.append((page, writer))
+        except Exception as e:
+            log.error(f"Could not write HTML file {page['output_filename']}: {e}")
+    if writers:
+        for chunk in iter_catalog():
+            for page, writer in writers:
+                with RUN_REPORT.span("filter", page=page["output_filename"]):
+                    page_rows = apply_filters(chunk, page["filter_dict"])
+                with RUN_REPORT.span("render", page=page["output_filename"]):
+                    writer.write_rows(page_rows)
+    for page, writer in writers:
+        with RUN_REPORT.span("write", page=page["output_filename"]):
+            writer.close()
+        # Record the inputs as they are after writing (rendering may have backfilled derivatives)
+        builds[page["output_filename"]] = dict(page_inputs(page), outputs=writer.outputs, **page["files"])
+    if writers:
+        save_build_manifest(builds)
+        prune_unreferenced(builds, RUN_REPORT.started)
+    log.info(f"Rebuilt {len(writers)} page(s); {sum(1 for page in pages if not page['reason'])} already up to date.")
+    RUN_REPORT.log_summary(logging.INFO if args.report else logging.DEBUG)
+    if args.report:
+        RUN_REPORT.write(args.report)
+        log.info(f"Run report written to {args.report}")
+    return len(writers)
+
+# --- Watch Mode ---
+def watched_state():
+    """(CSV, thumbnail store) modification signatures; either changes when the file is saved or a thumbnail is added, replaced or removed."""
+    def signature(path):
+        try:
+            stat = os.stat(path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+    return signature(CSV_PATH), signature(THUMBNAIL_STORE_DIR)
+
+def catalog_rows():
+    """(set of row hashes, set of URLs) of the current CSV, for diffing one version against the next."""
+    row_hashes = set()
+    urls = set()
+    for chunk in iter_catalog():
+        row_hashes.update(pd.util.hash_pandas_object(chunk, index=False).tolist())
+        urls.update(page_urls(chunk))
+    return row_hashes, urls
+
+def watch(pages):
+    """Build the pages, then rebuild them whenever the CSV or the thumbnail store changes, until interrupted.
+
+    The catalog, the facet index and the capture browsers stay in memory between
+    builds. URLs new to the CSV are recaptured; the build manifest limits
+    rewriting to the pages whose rows or thumbnails changed.
+    """
+    global CATALOG, FACET_INDEX, KEEP_DRIVERS
+    KEEP_DRIVERS = True
+    try:
+        build_pages(pages)
+        rows, urls = catalog_rows()
+        state = watched_state()
+        log.info(f"Watching {CSV_PATH} and {THUMBNAIL_STORE_DIR} for changes (Ctrl-C to stop)...")
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            current = watched_state()
+            if current == state:
+                continue
+            # Let an editor or download finish writing before reading the file
+            time.sleep(WATCH_INTERVAL)
+            if watched_state() != current:
+                continue
+            try:
+                new_urls = set()
+                if current[0] != state[0]:
+                    CATALOG = None
+                    FACET_INDEX = None
+                    new_rows, current_urls = catalog_rows()
+                    new_urls = current_urls - urls
+                    log.info(f"{CSV_PATH} changed: {len(new_rows - rows)} row(s) added or edited, {len(rows - new_rows)} removed, {len(new_urls)} new URL(s).")
+                else:
+                    new_rows, current_urls = rows, urls
+                    log.info(f"{THUMBNAIL_STORE_DIR} changed.")
+                build_pages(pages, refresh_urls=new_urls)
+                rows, urls = new_rows, current_urls
+            except (Exception, SystemExit) as e:
+                log.error(f"Rebuild failed, waiting for the next change: {e}")
+            state = watched_state()
+    except KeyboardInterrupt:
+        log.info("Stopped watching.")
+    finally:
+        close_idle_drivers()
+
+class LevelPrefixFormatter(logging.Formatter):
+    """Plain messages at INFO, "LEVEL: message" otherwise."""
+
+    def format(self, record):
+        message = super().format(record)
+        return message if record.levelno == logging.INFO else f"{record.levelname}: {message}"
+
+def setup_logging(level):
+    """Send this script's log (and cdp_capture's) to stdout at level; other libraries only warn."""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(LevelPrefixFormatter("%(message)s"))
+    logging.getLogger().addHandler(handler)
+    logging.getLogger().setLevel(logging.WARNING)
+    for name in ("filterthumbs", "cdp_capture"):
+        logging.getLogger(name).setLevel(level)
+
+# Parse command-line arguments
+parser = argparse.ArgumentParser(description="Generate HTML dashboards based on filtered CSV data with cached, refreshed, or direct iframe content.")
+parser.add_argument("--filter", nargs='*', help="Filter conditions as key-value pairs (e.g., --filter Country Mali Season JAS Type 'Design Dashboard'). For multiple values for a single column, use a comma-separated list (e.g., --filter Season JAS,OND).")
+parser.add_argument("--output", help="Specify the output HTML filename (e.g., --output my_dashboards.html). If not specified, a filename will be generated based on filter criteria.")
+parser.add_argument("--refresh-thumbnails", action="store_true", help="Force regeneration of all thumbnails, ignoring cached versions.")
+parser.add_argument("--refresh-stale", action="store_true", help=f"Recapture thumbnails older than their TTL ({THUMBNAIL_TTL_DAYS} days; {PINNED_DATE_TTL_DAYS} for rows with a 'Specific date?', {INACTIVE_TTL_DAYS} for inactive rows), plus any missing thumbnails, most stale first. Combine with --time-budget for bounded cron runs.")
+parser.add_argument("--time-budget", type=float, help="Stop starting new captures once the next one would likely end more than this many seconds after the run started; the rest are left for the next run. Missing and most stale thumbnails are captured first.")
+parser.add_argument("--refresh-changed", action="store_true", help="Recapture only dashboards whose page changed since their last capture (checked with cheap ETag/Last-Modified/body-hash requests), plus any missing thumbnails.")
+parser.add_argument("--change-threshold", type=int, default=PHASH_THRESHOLD, help=f"Keep a stored thumbnail untouched when its recapture's perceptual hash differs from it in fewer than this many of {PHASH_SIZE ** 2} bits, so unchanged dashboards don't produce new files to publish (default: {PHASH_THRESHOLD}; 0 always writes the new capture).")
+parser.add_argument("--retries", type=int, default=CAPTURE_RETRIES, help=f"Extra attempts at a capture that fails, after a short backoff (default: {CAPTURE_RETRIES}). Dashboards still failing are skipped by later runs for {FAILURE_TTL // 3600}h, doubling with each run they fail in, and a host failing {HOST_FAILURE_THRESHOLD} captures in a row is skipped for {HOST_COOLDOWN}s.")
+parser.add_argument("--retry-failed", action="store_true", help=f"Capture dashboards that failed recently (recorded in {FAILURES_PATH}) instead of skipping them.")
+# New command-line option for direct iframes
+parser.add_argument("--direct-iframes", action="store_true", help="Generate HTML using iframes directly for all dashboards, skipping thumbnail generation/caching.")
+parser.add_argument("--workers", type=int, default=1, help="Number of headless browsers (or tabs, with --engine cdp) to capture thumbnails with in parallel (default: 1).")
+parser.add_argument("--per-host", type=int, default=HOST_MAX_CAPTURES, help=f"Most captures of one host (server) in flight at once; --workers still limits the total, and workers go to other hosts meanwhile (default: {HOST_MAX_CAPTURES}).")
+parser.add_argument("--host-interval", type=float, default=HOST_MIN_INTERVAL, help=f"Least seconds between the starts of two captures of one host (default: {HOST_MIN_INTERVAL}).")
+parser.add_argument("--engine", choices=["selenium", "cdp"], default="selenium", help="Capture backend: 'selenium' drives one chromedriver browser per worker (default); 'cdp' drives --workers tabs of a single headless Chrome over the DevTools Protocol (needs the websockets package).")
+parser.add_argument("--browser-profile", default=BROWSER_PROFILE_DIR, help=f"Directory to keep the capture browsers' profiles in between runs, so the scripts, styles and map tiles many dashboards share stay in their HTTP cache (at most {BROWSER_CACHE_MAX_MB} MB per browser); 'none' starts every browser with an empty profile (default: {BROWSER_PROFILE_DIR}).")
+parser.add_argument("--clear-browser-cache", action="store_true", help="Empty the browser profiles in --browser-profile before capturing.")
+parser.add_argument("--clip", help=f"Capture only part of each dashboard page: 'tile' for just what a tile shows, 'x,y,width,height' in page pixels, or a CSS selector such as '#map' for that element. A '{CLIP_COLUMN}' column in the CSV sets it per dashboard ('full' for the whole viewport). Requires Pillow.")
+parser.add_argument("--framewidth", type=int, default=FRAME_WIDTH, help=f"Width in CSS pixels of each tile in the grid; thumbnail derivatives are sized to match (default: {FRAME_WIDTH}).")
+parser.add_argument("--thumbnail-format", choices=["webp", "jpeg"], default=DERIVATIVE_FORMAT, help=f"Image format of the display-sized thumbnail derivatives (default: {DERIVATIVE_FORMAT}). Requires Pillow; without it the full-size PNG is used.")
+parser.add_argument("--sprite", action="store_true", help="Pack the thumbnails of the page into a few cached sprite atlases and draw tiles with CSS background offsets, so the page makes a handful of image requests instead of one per dashboard. Requires Pillow.")
+parser.add_argument("--faceted", action="store_true", help=f"Write one browsable page plus a compact JSON index of the dashboards instead of a fixed page; visitors filter by {', '.join(FACET_COLUMNS)} in the browser. --filter still limits which dashboards are indexed. Default output: dashboard_browser.html.")
+parser.add_argument("--max-live-iframes", type=int, default=MAX_LIVE_IFRAMES, help=f"Most live dashboard iframes a generated page runs at once; iframes load only when scrolled near and unload when scrolled away (default: {MAX_LIVE_IFRAMES}, 0 = no cap).")
+parser.add_argument("--chunksize", type=int, help="Read and filter dashboards.csv this many rows at a time instead of loading it whole, keeping memory flat for very large catalogs.")
+parser.add_argument("--manifest", help="Build every page listed in a YAML/JSON manifest (e.g., --manifest pages.yaml) in one run: the CSV is read once and each dashboard is captured at most once for all pages. --filter and --output are ignored.")
+parser.add_argument("--rebuild-all", action="store_true", help=f"Rewrite every page even if its CSV rows, thumbnails and templates are unchanged since the last build (recorded in {BUILD_MANIFEST_PATH}).")
+parser.add_argument("--watch", action="store_true", help=f"Keep running after the build and rebuild whenever {CSV_PATH} or the thumbnail store changes: URLs new to the CSV are captured (with browsers kept open between builds) and only the pages whose rows or thumbnails changed are rewritten. Stop with Ctrl-C.")
+parser.add_argument("--report", help="Write a timing report of the run to this file: JSON with per-phase percentiles, the slowest URLs and every URL's phase times, or with a .csv name one row per URL and page with a column per phase.")
+parser.add_argument("-v", "--verbose", action="store_true", help="Log debug detail (every URL, row and file).")
+parser.add_argument("-q", "--quiet", action="store_true", help="Log only warnings and errors.")
+parser.add_argument("--quiet-window", type=float, default=READY_QUIET_WINDOW, help=f"Seconds a page must have no in-flight requests and no DOM changes before it is captured (default: {READY_QUIET_WINDOW}).")
+parser.add_argument("--max-wait", type=float, default=READY_MAX_WAIT, help=f"Hard cap in seconds on waiting for a page to settle before capturing it anyway (default: {READY_MAX_WAIT}).")
+args = parser.parse_args(None if __name__ == "__main__" else []) # Imported (e.g. by the tests): defaults only
+setup_logging(logging.DEBUG if args.verbose else logging.WARNING if args.quiet else logging.INFO)
+READY_QUIET_WINDOW = args.quiet_window
+READY_MAX_WAIT = args.max_wait
+FRAME_WIDTH = THUMBNAIL_CLIP_WIDTH = args.framewidth
+DERIVATIVE_FORMAT = args.thumbnail_format
+CSV_CHUNKSIZE = args.chunksize
+MAX_LIVE_IFRAMES = args.max_live_iframes
+PHASH_THRESHOLD = args.change_threshold
+THUMBNAIL_CLIP = args.clip
 try:
-    with open(output_filename, "w", encoding="utf-8") as f:
-        f.write(html)
-    print(f"Generated {output_filename}")
-except Exception as e:
-    print(f"ERROR: Could not write HTML file {output_filename}: {e}") # DEBUG PRINT
+    parse_clip(THUMBNAIL_CLIP)
+except ValueError as e:
+    parser.error(f"--clip: {e}")
+if THUMBNAIL_CLIP and Image is None:
+    log.warning("--clip needs Pillow to draw clipped thumbnails; capturing the whole viewport instead.")
+BROWSER_PROFILE_DIR = None if args.browser_profile.lower() == "none" else args.browser_profile
+if args.clear_browser_cache:
+    clear_profiles()
+
+if __name__ == "__main__":
+    # One page from the command line, or every page of a manifest
+    if args.manifest:
+        pages = load_manifest(args.manifest)
+        log.info(f"Building {len(pages)} page(s) from {args.manifest}")
+    else:
+        pages = [{"filter": args.filter, "output": args.output, "direct_iframes": args.direct_iframes, "sprite": args.sprite, "faceted": args.faceted}]
+
+    # Name each page from its filters
+    for page in pages:
+        page["filter_dict"], filter_summary = parse_filter_args(page["filter"])
+        if page["faceted"]:
+            page["output_filename"] = page["output"] or "_".join([re.sub(r'[^\w-]', '', part).lower() for part in filter_summary] + ["dashboard_browser.html"])
+            log.info(f"Generating faceted browser page: {page['output_filename']}")
+        else:
+            page["output_filename"] = page_output_filename(page["output"], filter_summary, page["direct_iframes"])
+
+    if args.watch:
+        watch(pages)
+    else:
+        build_pages(pages)
@@ -0,0 +1,123 @@
+"""--refresh-changed against a local stand-in dashboard server."""
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import filterthumbs
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """/etag/<name> answers with ETag "<version>" and honours If-None-Match;
+    /plain/<name> has no validators at all, only a body."""
+
+    versions = {} # {name: version}, shared by the server's handler threads
+
+    def do_GET(self):
+        kind, name = self.path.strip("/").split("/")
+        version = self.versions.get(name, 1)
+        body = f"<html>{name} version {version}</html>".encode("utf-8")
+        if kind == "etag":
+            etag = f'"{name}-{version}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StandInHandler.versions = {}
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def unreachable_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/etag/gone" # Nothing listens there any more
+
+
+@pytest.fixture
+def validator_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(filterthumbs, "VALIDATOR_CACHE_PATH", str(tmp_path / "validators.json"))
+    monkeypatch.setattr(filterthumbs, "CAPTURED_URLS", set())
+
+
+def test_not_modified(server):
+    url = f"{server}/etag/map"
+    changed, validators = filterthumbs.check_for_change(url, {})
+    assert changed
+    assert validators["etag"] == '"map-1"'
+
+    assert filterthumbs.check_for_change(url, validators) == (False, validators)
+
+
+def test_changed_etag(server):
+    url = f"{server}/etag/map"
+    _, validators = filterthumbs.check_for_change(url, {})
+    StandInHandler.versions["map"] = 2
+
+    changed, fresh = filterthumbs.check_for_change(url, validators)
+    assert changed
+    assert fresh["etag"] == '"map-2"'
+    assert fresh["body_hash"] != validators["body_hash"]
+
+
+def test_unchanged_body_hash(server):
+    url = f"{server}/plain/doc"
+    _, validators = filterthumbs.check_for_change(url, {})
+    assert validators["etag"] is None and validators["last_modified"] is None
+
+    changed, fresh = filterthumbs.check_for_change(url, validators)
+    assert not changed
+    assert fresh["body_hash"] == validators["body_hash"]
+
+    StandInHandler.versions["doc"] = 2
+    assert filterthumbs.check_for_change(url, validators)[0]
+
+
+def test_find_changed_urls(server, unreachable_url):
+    same, moved, new = f"{server}/etag/same", f"{server}/etag/moved", f"{server}/plain/new"
+    validators = {url: filterthumbs.check_for_change(url, {})[1] for url in (same, moved)}
+    StandInHandler.versions["moved"] = 2
+
+    changed_urls, fresh = filterthumbs.find_changed_urls([same, moved, new, unreachable_url], validators)
+
+    assert changed_urls == [moved, new]
+    assert set(fresh) == {same, moved, new} # An unreachable URL is kept as it is, not recaptured
+
+
+def test_record_validators_after_failed_capture(server, validator_cache):
+    captured, failed, unchanged = f"{server}/etag/captured", f"{server}/etag/failed", f"{server}/etag/unchanged"
+    old = {url: filterthumbs.check_for_change(url, {})[1] for url in (captured, failed, unchanged)}
+    filterthumbs.save_validators(old)
+    StandInHandler.versions.update(captured=2, failed=2)
+
+    changed_urls, fresh = filterthumbs.find_changed_urls([captured, failed, unchanged], old)
+    assert changed_urls == [captured, failed]
+    filterthumbs.CAPTURED_URLS.add(captured) # The capture of failed did not succeed
+
+    filterthumbs.record_validators([(url, f"{url}.png") for url in changed_urls], fresh)
+
+    validators = filterthumbs.load_validators()
+    assert validators[captured]["etag"] == '"captured-2"'
+    assert validators[failed] == old[failed] # Still changed next run, so it is captured then
+    assert validators[unchanged] == old[unchanged]